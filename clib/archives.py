@@ -0,0 +1,131 @@
+import gzip
+import pathlib
+import tarfile
+import time
+import zipfile
+import zlib
+
+try:
+    from lzma import LZMAError
+except ImportError:  # without the lzma module, tarfile cannot open .xz archives at all
+    LZMAError = EOFError
+
+BUFFER_SIZE = 1024 * 1024
+PROGRESS_INTERVAL = 5
+MAX_ARCHIVE_BYTES = 10 * 1024 ** 3
+MAX_ARCHIVE_MEMBERS = 100_000
+
+
+class ArchiveError(Exception):
+    pass
+
+
+# what extracting a broken, encrypted or unsupported archive may raise besides ArchiveError: zipfile raises
+# RuntimeError for encrypted and NotImplementedError for unsupported members, the decompressors their own errors
+ARCHIVE_ERRORS = (ArchiveError, OSError, EOFError, zipfile.BadZipFile, tarfile.TarError, zlib.error, LZMAError,
+                  RuntimeError, NotImplementedError)
+
+
+class ArchiveExtractor:
+    """
+    Extracts .zip, .tar (optionally compressed) and .gz archives member by member through a bounded buffer.
+    Extraction stops with ArchiveError as soon as the archive writes more than max_bytes or has more than
+    max_members members, or a member would be written outside the destination folder.
+    """
+
+    def __init__(self, max_bytes=MAX_ARCHIVE_BYTES, max_members=MAX_ARCHIVE_MEMBERS, progress=print):
+        self.max_bytes = max_bytes
+        self.max_members = max_members
+        self.progress = progress
+        self.bytes_written = 0
+        self.members = 0
+        self.started = None
+        self.reported = None
+        self.name = None
+
+    def extract(self, archive, destination):
+        """
+        Extracts the archive into the destination folder and returns the number of bytes written
+        and the time it took in seconds.
+        """
+        archive = pathlib.Path(archive)
+        destination = pathlib.Path(destination)
+        self.name = archive.name
+        self.bytes_written = 0
+        self.members = 0
+        self.started = self.reported = time.perf_counter()
+        destination.mkdir(parents=True, exist_ok=True)
+
+        if zipfile.is_zipfile(archive):
+            self._extract_zip(archive, destination)
+        elif tarfile.is_tarfile(archive):
+            self._extract_tar(archive, destination)
+        elif archive.suffix.upper() == '.GZ':
+            self._count_member()
+            with gzip.open(archive, 'rb') as source:
+                self._copy(source, destination / archive.stem)
+        else:
+            raise ArchiveError(f'{archive.name} is not a supported archive')
+        return self.bytes_written, time.perf_counter() - self.started
+
+    def _extract_zip(self, archive, destination):
+        with zipfile.ZipFile(archive) as source:
+            for member in source.infolist():
+                self._count_member()
+                target = self._target(destination, member.filename)
+                if member.is_dir():
+                    target.mkdir(parents=True, exist_ok=True)
+                    continue
+                if self.bytes_written + member.file_size > self.max_bytes:
+                    raise ArchiveError(f'{self.name} unpacks to more than {self.max_bytes} bytes')
+                with source.open(member) as member_source:
+                    self._copy(member_source, target)
+
+    def _extract_tar(self, archive, destination):
+        # iterating the archive reads the member headers one at a time instead of loading the whole index
+        with tarfile.open(archive, 'r:*') as source:
+            for member in source:
+                self._count_member()
+                target = self._target(destination, member.name)
+                if member.isdir():
+                    target.mkdir(parents=True, exist_ok=True)
+                elif member.isfile():
+                    if self.bytes_written + member.size > self.max_bytes:
+                        raise ArchiveError(f'{self.name} unpacks to more than {self.max_bytes} bytes')
+                    self._copy(source.extractfile(member), target)
+
+    def _count_member(self):
+        self.members += 1
+        if self.members > self.max_members:
+            raise ArchiveError(f'{self.name} has more than {self.max_members} members')
+
+    @staticmethod
+    def _target(destination, name):
+        target = (destination / name).resolve()
+        if not target.is_relative_to(destination.resolve()):
+            raise ArchiveError(f'{name} points outside of the destination folder')
+        return target
+
+    def _copy(self, source, target):
+        target.parent.mkdir(parents=True, exist_ok=True)
+        with open(target, 'wb') as file:
+            while chunk := source.read(BUFFER_SIZE):
+                self.bytes_written += len(chunk)
+                if self.bytes_written > self.max_bytes:
+                    raise ArchiveError(f'{self.name} unpacks to more than {self.max_bytes} bytes')
+                file.write(chunk)
+                self._report()
+
+    def _report(self):
+        now = time.perf_counter()
+        if self.progress is not None and now - self.reported >= PROGRESS_INTERVAL:
+            self.reported = now
+            self.progress(f'Unpacking {self.name}: {format_rate(self.bytes_written, now - self.started)}')
+
+
+def format_rate(bytes_written, seconds):
+    """
+    Returns the amount of data and the throughput as a human-readable string.
+    """
+    megabytes = bytes_written / 1024 ** 2
+    return f'{megabytes:.1f} MB in {seconds:.2f} s ({megabytes / max(seconds, 1e-9):.1f} MB/s)'
@@ -0,0 +1,113 @@
+"""
+Generators of synthetic data for the benchmarks: address books, note books and folders for the sorter.
+All of them take a random.Random instance, so the same seed always gives the same data.
+"""
+import os
+import pathlib
+
+from clib import classes
+
+FIRST_NAMES = ('Olena', 'Taras', 'Iryna', 'Andrii', 'Oksana', 'Dmytro', 'Natalia', 'Serhii', 'Yuliia', 'Maksym',
+               'Kateryna', 'Oleksandr', 'Sofiia', 'Bohdan', 'Mariia', 'Volodymyr', 'Anna', 'Yaroslav', 'Daria', 'Ivan')
+LAST_NAMES = ('Shevchenko', 'Bondarenko', 'Kovalenko', 'Tkachenko', 'Kravchenko', 'Melnyk', 'Boiko', 'Koval',
+              'Oliinyk', 'Lysenko', 'Marchenko', 'Savchenko', 'Rudenko', 'Moroz', 'Petrenko', 'Pavlenko', 'Levchenko')
+STREETS = ('Khreshchatyk', 'Shevchenka', 'Franka', 'Lesi Ukrainky', 'Sadova', 'Hrushevskoho', 'Soborna')
+WORDS = ('buy', 'milk', 'call', 'meeting', 'project', 'report', 'doctor', 'birthday', 'gift', 'pay', 'bills', 'car',
+         'service', 'book', 'tickets', 'train', 'hotel', 'review', 'code', 'deploy', 'release', 'garden', 'plant',
+         'water', 'clean', 'kitchen', 'cook', 'dinner', 'friends', 'weekend', 'trip', 'mountains', 'sea', 'read',
+         'article', 'python', 'course', 'lesson', 'homework', 'exam', 'bank', 'insurance', 'passport', 'visa')
+TAGS = ('#home', '#work', '#shopping', '#family', '#travel', '#study', '#health', '#finance')
+EXTENSIONS = ('.jpg', '.png', '.svg', '.mp4', '.mov', '.mp3', '.wav', '.txt', '.pdf', '.docx', '.xlsx', '.py',
+              '.log', '.bak', '')
+
+
+def contact_name(number, rng):
+    """
+    Returns a unique one-word contact name; the number keeps it unique.
+    """
+    return f'{rng.choice(FIRST_NAMES)}{rng.choice(LAST_NAMES)}{number}'
+
+
+def phone_number(rng):
+    return f'0{rng.randrange(10 ** 9):09d}'
+
+
+def contact(number, rng):
+    """
+    Returns a record with one or two phones and, for some of the contacts, a birthday, an email and an address.
+    """
+    name = contact_name(number, rng)
+    record = classes.Record(classes.Name(name))
+    record.phones = [classes.Phone(phone_number(rng)) for _ in range(rng.randint(1, 2))]
+    if rng.random() < 0.7:
+        record.birthday = classes.Birthday(f'{rng.randint(1950, 2005)}-{rng.randint(1, 12):02d}-'
+                                           f'{rng.randint(1, 28):02d}')
+    if rng.random() < 0.5:
+        record.email = classes.Email(f'{name.lower()}@example.com')
+    if rng.random() < 0.3:
+        record.address = classes.Address(f'{rng.choice(STREETS)} {rng.randint(1, 200)}')
+    return record
+
+
+def fill_address_book(address_book, size, rng):
+    """
+    Adds size generated contacts to the address book and returns their names.
+    """
+    names = []
+    with address_book.bulk():
+        for number in range(size):
+            record = contact(number, rng)
+            address_book.add_record(record)
+            names.append(record.name.value)
+    return names
+
+
+def marker(number):
+    """
+    Returns the word that marks the note with the number. The markers have the same width, so that
+    no marker is a part of another one and searching for a marker finds exactly its note.
+    """
+    return f'n{number:07d}'
+
+
+def note(number, rng):
+    """
+    Returns a note of a few common words (the first ones are the most frequent) with up to two tags,
+    and the marker of its number.
+    """
+    words = rng.choices(WORDS, weights=range(len(WORDS), 0, -1), k=rng.randint(3, 15))
+    tags = rng.sample(TAGS, rng.randint(0, 2))
+    return classes.Note(f'{" ".join(words)} {marker(number)}', tags, rng.choice(WORDS).capitalize())
+
+
+def fill_note_book(note_book, size, rng):
+    """
+    Adds size generated notes to the note book.
+    """
+    with note_book.bulk():
+        for number in range(size):
+            note_book.add_note(note(number, rng))
+
+
+def make_tree(root, files, rng, depth=3, duplicates=0.1):
+    """
+    Creates a folder tree with the given number of small files of the sorted and some unknown types.
+    A share of the files repeats the content of an earlier file, for the deduplication of the sorter.
+    """
+    root = pathlib.Path(root)
+    folders = [root]
+    contents = []
+    for number in range(files):
+        if len(folders) < depth * 4 and rng.random() < 0.05:
+            parent = rng.choice(folders)
+            if len(parent.relative_to(root).parts) < depth:
+                folders.append(parent / f'folder{len(folders)}')
+        folder = rng.choice(folders)
+        os.makedirs(folder, exist_ok=True)
+        if contents and rng.random() < duplicates:
+            content = rng.choice(contents)
+        else:
+            content = rng.randbytes(rng.randint(64, 4096))
+            contents = contents[-99:] + [content]
+        (folder / f'file{number}{rng.choice(EXTENSIONS)}').write_bytes(content)
+    return root
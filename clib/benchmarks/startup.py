@@ -0,0 +1,52 @@
+"""
+Measures how long clib takes to start. Run it from the folder with address_book.bin and note_book.bin:
+
+    python -m clib.benchmarks.startup --repeat 5
+
+Every run happens in a fresh interpreter, so the import time is a cold import of clib.main,
+and each store is loaded separately on first access.
+"""
+import argparse
+import json
+import statistics
+import subprocess
+import sys
+
+PROBE = '''
+import json, time
+start = time.perf_counter()
+import clib.main
+imported = time.perf_counter()
+from clib import classes
+classes.address_book
+address_book_loaded = time.perf_counter()
+classes.note_book
+note_book_loaded = time.perf_counter()
+print(json.dumps({'import': imported - start,
+                  'address_book': address_book_loaded - imported,
+                  'note_book': note_book_loaded - address_book_loaded}))
+'''
+
+
+def measure(repeat):
+    """
+    Runs the probe in `repeat` fresh interpreters and returns the median and maximum time of each stage in seconds.
+    """
+    runs = []
+    for _ in range(repeat):
+        output = subprocess.run([sys.executable, '-c', PROBE], capture_output=True, text=True, check=True).stdout
+        runs.append(json.loads(output))
+    return {stage: {'median': statistics.median(run[stage] for run in runs),
+                    'max': max(run[stage] for run in runs)}
+            for stage in runs[0]}
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Reports clib import and store load times separately.')
+    parser.add_argument('--repeat', type=int, default=5, help='number of fresh interpreters to measure')
+    arguments = parser.parse_args()
+    print(json.dumps(measure(arguments.repeat), indent=2))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,275 @@
+"""
+Times every command of clib on generated data and reports the results as JSON:
+
+    python -m clib.benchmarks.suite --contacts 100000 --notes 100000 --files 2000 --output results.json
+
+The books and the folders for the sorter are generated in a temporary folder, which becomes the working folder
+for the run, so the stores of the user are never touched. Each command is run through clib.main.execute()
+and its output is written to os.devnull, so the time includes formatting the output. The peak memory of every
+command is measured in an extra run with tracemalloc, which would slow the timed runs down. The answers
+to the questions that some commands ask are given by a replaced input().
+"""
+import argparse
+import builtins
+import contextlib
+import csv
+import json
+import os
+import platform
+import random
+import tempfile
+import time
+import tracemalloc
+
+from clib import classes, exchange, functions
+from clib.instrumentation import percentile
+from clib.main import execute, handler_commands
+from clib.benchmarks import generators
+
+HEAVY_COMMANDS = {'show all', 'sort', 'import', 'export'}
+IMPORT_ROWS = 1000
+
+
+class Workloads:
+    """
+    Makes the input line (and the answers to the questions of the command) for the next run of every command.
+    Commands that delete something take names and notes out of the pools, so every run has something to delete.
+    """
+
+    def __init__(self, rng, names, notes, folder, files):
+        self.rng = rng
+        self.names = names
+        self.notes = list(range(notes))
+        self.folder = folder
+        self.files = files
+        self.added = 0
+        self.trees = 0
+        self.import_file = os.path.join(folder, 'contacts.csv')
+        self._write_import_file()
+
+    def _write_import_file(self):
+        with open(self.import_file, 'w', encoding='utf-8', newline='') as file:
+            writer = csv.writer(file)
+            writer.writerow(exchange.CSV_FIELDS)
+            for number in range(IMPORT_ROWS):
+                writer.writerow([f'Imported{number}', generators.phone_number(self.rng), '1990-01-01', '', ''])
+
+    def name(self):
+        return self.rng.choice(self.names)
+
+    def name_with_phone(self):
+        for _ in range(100):
+            name = self.name()
+            phones = classes.address_book.data[name].phones
+            if phones:
+                return name, phones[0].value
+        raise LookupError('no contacts with phones left')
+
+    def new_name(self):
+        self.added += 1
+        return f'Added{self.added}'
+
+    def typo(self, name):
+        position = self.rng.randrange(len(name))
+        return f'{name[:position]}x{name[position + 1:]}'
+
+    def note(self):
+        return self.notes[self.rng.randrange(len(self.notes))]
+
+    def take_note(self):
+        return self.notes.pop(self.rng.randrange(len(self.notes)))
+
+    def take_name(self):
+        return self.names.pop(self.rng.randrange(len(self.names)))
+
+    def tree(self):
+        self.trees += 1
+        return generators.make_tree(os.path.join(self.folder, f'tree{self.trees}'), self.files, self.rng)
+
+    def change_phone(self):
+        name, phone = self.name_with_phone()
+        return f'change phone {name} {phone} {generators.phone_number(self.rng)}', []
+
+    def delete_phone(self):
+        name, phone = self.name_with_phone()
+        return f'delete phone {name} {phone}', []
+
+    def edit_note(self):
+        marker = generators.marker(self.note())
+        return f'edit note {marker}', [f'edited note {marker}']
+
+    def lines(self):
+        """
+        Returns the functions that make the (input line, answers) pair for every command.
+        """
+        return {
+            'hello': lambda: ('hello', []),
+            'hi': lambda: ('hi', []),
+            'help': lambda: ('help', []),
+            'good bye': lambda: ('good bye', []),
+            'exit': lambda: ('exit', []),
+            'close': lambda: ('close', []),
+            'add': lambda: (f'add {self.new_name()} {generators.phone_number(self.rng)} 1991-03-04', []),
+            'add birthday': lambda: (f'add birthday {self.name()} 1985-06-07', []),
+            'add email': lambda: (f'add email {self.name()} someone@example.com', []),
+            'add address': lambda: (f'add address {self.name()} Soborna 12', []),
+            'change phone': self.change_phone,
+            'get phone': lambda: (f'get phone {self.name()}', []),
+            'who': lambda: (f'who {self.name_with_phone()[1]}', []),
+            'get birthday': lambda: (f'get birthday {self.name()}', []),
+            'get email': lambda: (f'get email {self.name()}', []),
+            'get address': lambda: (f'get address {self.name()}', []),
+            'birthdays': lambda: ('birthdays 30', []),
+            'delete phone': self.delete_phone,
+            'show': lambda: (f'show {self.name()[3:9]}', []),
+            'show all': lambda: ('show all', []),
+            'show page': lambda: (f'show page {self.rng.randint(1, max(1, len(self.names) // 20))} 20', []),
+            'find fuzzy': lambda: (f'find fuzzy {self.typo(self.name())}', []),
+            'delete': lambda: (f'delete {self.take_name()}', []),
+            'import': lambda: (f'import {self.import_file}', []),
+            'export': lambda: (f'export {os.path.join(self.folder, "exported.csv")}', []),
+            'add note': lambda: (f'add note {" ".join(self.rng.sample(generators.WORDS, 5))} #work', []),
+            'find note': lambda: (f'find note {self.rng.choice(generators.WORDS)}', []),
+            'edit note': self.edit_note,
+            'delete note': lambda: (f'delete note {generators.marker(self.take_note())}', []),
+            'sort': lambda: (f'sort {self.tree()}', []),
+        }
+
+
+@contextlib.contextmanager
+def answering(answers):
+    """
+    Replaces input() with a function that returns the given answers one by one (and then empty strings).
+    """
+    answers = list(answers)
+    original = builtins.input
+    builtins.input = lambda prompt='': answers.pop(0) if answers else ''
+    try:
+        yield
+    finally:
+        builtins.input = original
+
+
+def run_command(line, answers, devnull):
+    with answering(answers), contextlib.redirect_stdout(devnull):
+        started = time.perf_counter()
+        functions.print_output(execute(line), devnull)
+        return time.perf_counter() - started
+
+
+def summarize(latencies, peak_memory=None):
+    latencies = sorted(latencies)
+    total = sum(latencies)
+    return {'runs': len(latencies),
+            'throughput': len(latencies) / total if total else None,
+            'latency_ms': {'mean': total / len(latencies) * 1000,
+                           'p50': percentile(latencies, 0.5) * 1000,
+                           'p90': percentile(latencies, 0.9) * 1000,
+                           'p99': percentile(latencies, 0.99) * 1000,
+                           'max': latencies[-1] * 1000},
+            'peak_memory_kb': None if peak_memory is None else peak_memory / 1024}
+
+
+def benchmark_command(make_line, repeat, devnull):
+    latencies = [run_command(*make_line(), devnull) for _ in range(repeat)]
+    tracemalloc.start()
+    try:
+        run_command(*make_line(), devnull)
+        peak_memory = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+    return summarize(latencies, peak_memory)
+
+
+def benchmark_storage(repeat):
+    """
+    Times saving the whole stores and loading them again in new objects.
+    """
+    results = {}
+    for name, store in (('address_book', classes.AddressBook), ('note_book', classes.Notes)):
+        saves = []
+        for _ in range(repeat):
+            started = time.perf_counter()
+            getattr(classes, name).save_data()
+            saves.append(time.perf_counter() - started)
+        results[f'{name}.save_data'] = summarize(saves)
+        loads = []
+        for _ in range(repeat):
+            started = time.perf_counter()
+            store().close()
+            loads.append(time.perf_counter() - started)
+        results[f'{name}.load'] = summarize(loads)
+    return results
+
+
+def run(arguments):
+    """
+    Generates the data, runs the benchmarks and returns the results as a dictionary.
+    """
+    rng = random.Random(arguments.seed)
+    results = {'meta': {'contacts': arguments.contacts, 'notes': arguments.notes, 'files': arguments.files,
+                        'repeat': arguments.repeat, 'heavy_repeat': arguments.heavy_repeat, 'seed': arguments.seed,
+                        'storage': os.environ.get('CLIB_STORAGE', 'pickle'), 'python': platform.python_version(),
+                        'started': time.strftime('%Y-%m-%dT%H:%M:%S')},
+               'setup_s': {}, 'commands': {}, 'storage': {}}
+
+    started = time.perf_counter()
+    names = generators.fill_address_book(classes.address_book, arguments.contacts, rng)
+    results['setup_s']['address_book'] = time.perf_counter() - started
+    started = time.perf_counter()
+    generators.fill_note_book(classes.note_book, arguments.notes, rng)
+    results['setup_s']['note_book'] = time.perf_counter() - started
+
+    workloads = Workloads(rng, names, arguments.notes, os.getcwd(), arguments.files).lines()
+    with open(os.devnull, 'w') as devnull:
+        for command in handler_commands:
+            if arguments.commands and command not in arguments.commands:
+                continue
+            if command not in workloads:
+                results['commands'][command] = {'skipped': 'no workload for this command'}
+                continue
+            repeat = arguments.heavy_repeat if command in HEAVY_COMMANDS else arguments.repeat
+            results['commands'][command] = benchmark_command(workloads[command], repeat, devnull)
+
+    results['storage'] = benchmark_storage(arguments.heavy_repeat)
+    return results
+
+
+def parse_arguments(argv=None):
+    parser = argparse.ArgumentParser(description='Times every clib command on generated data.')
+    parser.add_argument('--contacts', type=int, default=10_000, help='number of generated contacts')
+    parser.add_argument('--notes', type=int, default=10_000, help='number of generated notes')
+    parser.add_argument('--files', type=int, default=500, help='number of files in every folder to sort')
+    parser.add_argument('--repeat', type=int, default=20, help='runs of every command')
+    parser.add_argument('--heavy-repeat', type=int, default=3,
+                        help=f'runs of the commands that process everything ({", ".join(sorted(HEAVY_COMMANDS))}) '
+                             f'and of saving and loading the stores')
+    parser.add_argument('--seed', type=int, default=0, help='seed of the generated data')
+    parser.add_argument('--commands', nargs='*', help='only time these commands')
+    parser.add_argument('--output', help='write the JSON to this file instead of the standard output')
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    arguments = parse_arguments(argv)
+    if classes.is_loaded('address_book') or classes.is_loaded('note_book'):
+        raise RuntimeError('the benchmarks must run before the stores are loaded')
+    working_folder = os.getcwd()
+    with tempfile.TemporaryDirectory(prefix='clib-benchmark-') as folder:
+        os.chdir(folder)
+        try:
+            results = run(arguments)
+            functions.write_file()
+        finally:
+            os.chdir(working_folder)
+
+    report = json.dumps(results, indent=2)
+    if arguments.output:
+        with open(arguments.output, 'w', encoding='utf-8') as file:
+            file.write(report + '\n')
+    else:
+        print(report)
+
+
+if __name__ == '__main__':
+    main()
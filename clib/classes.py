@@ -1,9 +1,107 @@
-from collections import UserDict, UserList
-from datetime import datetime
-from pickle import load, dump
+from bisect import bisect_left, bisect_right, insort
+from calendar import isleap
+from collections import Counter, UserDict
+from contextlib import contextmanager
+from datetime import date, datetime, timedelta
+from heapq import nsmallest
+from math import log
+from pickle import load, dump, dumps, UnpicklingError
 from pathlib import Path
+import os
 import re
 
+from clib.instrumentation import persistence
+
+JOURNAL_COMPACT_THRESHOLD = 1000
+PHONE_RE = re.compile(r'\+\d{12}|\d{12}|\d{10}')
+EMAIL_RE = re.compile(r'[A-Za-z][A-Za-z0-9._]+@[A-Za-z]+\.[A-Za-z]{2,}')
+DATE_RE = re.compile(r'(\d{4})-(\d{1,2})-(\d{1,2})')
+COUNTRY_CODE = '380'
+VALUE_SEPARATOR = '\x00'
+
+
+def value_of(field):
+    return '' if field is None else field.value
+
+
+def pack_values(birthday, email, address, phones):
+    """
+    Returns the values of the fields of a record packed into one string, see Record.
+    """
+    return VALUE_SEPARATOR.join((birthday or '', email or '', address or '', *phones))
+
+
+def parse_date(value):
+    """
+    Returns the date written as YYYY-MM-DD, or None if the value is not a valid date. The common form is parsed
+    with a compiled pattern; only the other forms that strptime accepts (like a day with a leading space) use it.
+    """
+    match = DATE_RE.fullmatch(value)
+    try:
+        if match is not None:
+            return date(int(match[1]), int(match[2]), int(match[3]))
+        return datetime.strptime(value, '%Y-%m-%d').date()
+    except ValueError:
+        return None
+
+
+def phone_number(phone):
+    """
+    Returns the phone, written in any of the accepted formats, as an integer with the country code:
+    +380951112233, 380951112233 and 0951112233 all give 380951112233.
+    """
+    digits = phone.lstrip('+')
+    if len(digits) == 10 and digits.startswith('0'):
+        digits = COUNTRY_CODE + digits[1:]
+    return int(digits)
+
+
+def day_ordinal(day):
+    """
+    Returns the number of the day in a leap year (1-366) that has the same month and day as the given date,
+    so that birthdays of all years can be compared with each other.
+    """
+    return (date(2000, day.month, day.day) - date(2000, 1, 1)).days + 1
+
+
+def next_birthday(born, today):
+    """
+    Returns the date of the next birthday on or after today. Those born on February 29 celebrate it
+    on February 28 in common years.
+    """
+    for year in (today.year, today.year + 1):
+        try:
+            birthday = born.replace(year=year)
+        except ValueError:
+            birthday = date(year, 2, 28)
+        if birthday >= today:
+            return birthday
+
+
+def edit_distance(first, second, limit):
+    """
+    Returns the Levenshtein distance between two strings, or limit + 1 as soon as it is known to exceed the limit.
+    """
+    if abs(len(first) - len(second)) > limit:
+        return limit + 1
+    previous = list(range(len(second) + 1))
+    for i, char in enumerate(first, 1):
+        current = [i]
+        for j, other in enumerate(second, 1):
+            current.append(min(previous[j] + 1, current[j - 1] + 1, previous[j - 1] + (char != other)))
+        if min(current) > limit:
+            return limit + 1
+        previous = current
+    return min(previous[-1], limit + 1)
+
+
+def fuzzy_key(name):
+    """
+    Returns the lowercase name padded with two spaces on both sides, so that its first and last letters
+    are a part of as many trigrams as the other letters.
+    """
+    return f'  {name.lower()}  '
+
 
 class DataTransfer:
 
@@ -17,83 +115,752 @@ class DataTransfer:
         return None
 
     def save_data(self, data):
-        with open(self.filename, 'wb') as file:
+        # the old file is only replaced once the new one is complete, so a crash never leaves it torn
+        temporary = f'{self.filename}.tmp'
+        with open(temporary, 'wb') as file:
             dump(data, file)
+        os.replace(temporary, self.filename)
 
 
-class AddressBook(UserDict):
+class Journal:
+    """
+    Append-only log of the changes made since the last snapshot. Every entry is pickled on its own,
+    so writing it costs the size of the change rather than the size of the whole book.
+    While Journal.deferred is set, the pickled entries are kept in memory and written together by commit().
+    """
+    deferred = False
+
+    def __init__(self, filename):
+        self.filename = filename
+        self.entries = 0
+        self._file = None
+        self._pending = []
+
+    def replay(self):
+        """
+        Yields the entries stored in the journal. An entry torn by a crash at the end of the file is dropped.
+        """
+        if not Path(self.filename).exists():
+            return
+        with open(self.filename, 'rb+') as file:
+            while True:
+                position = file.tell()
+                try:
+                    entry = load(file)
+                except EOFError:
+                    break
+                except (UnpicklingError, ValueError, AttributeError, ImportError, IndexError):
+                    file.truncate(position)
+                    break
+                self.entries += 1
+                yield entry
+
+    def append(self, entry):
+        self.entries += 1
+        if self.deferred:
+            self._pending.append(dumps(entry))
+            return
+        if self._file is None:
+            self._file = open(self.filename, 'ab')
+        dump(entry, self._file)
+        self._file.flush()
+
+    def commit(self):
+        """
+        Writes the deferred entries to the journal file at once.
+        """
+        if self._pending:
+            if self._file is None:
+                self._file = open(self.filename, 'ab')
+            self._file.write(b''.join(self._pending))
+            self._file.flush()
+            self._pending.clear()
+
+    def clear(self):
+        self._pending.clear()
+        self.close()
+        Path(self.filename).unlink(missing_ok=True)
+        self.entries = 0
+
+    def close(self):
+        self.commit()
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+
+class PickleStorage:
+    """
+    Keeps a store in a pickled snapshot (<name>.bin) and a journal of the changes made since (<name>.journal).
+    While bulk is set, the changes are not journaled; the store is saved in a single snapshot by save() instead.
+    """
+
+    def __init__(self, name):
+        self.snapshot = DataTransfer(f'{name}.bin')
+        self.journal = Journal(f'{name}.journal')
+        self.owner = None
+        self.bulk = False
+
+    def load(self, owner):
+        """
+        Fills owner.data from the snapshot and applies the journaled changes to it with owner._apply.
+        """
+        self.owner = owner
+        loaded_data = self.snapshot.load_data()
+
+        if loaded_data:
+            owner.data = loaded_data
+
+        for entry in self.journal.replay():
+            owner._apply(entry)
+
+    @persistence
+    def log(self, entry):
+        if self.bulk:
+            return
+        self.journal.append(entry)
+        # while the entries are deferred, the journal is compacted at most once, when they are committed
+        if not Journal.deferred and self.journal.entries >= JOURNAL_COMPACT_THRESHOLD:
+            self.save()
+
+    @persistence
+    def save(self):
+        """
+        Folds the journal into a new snapshot of the whole store.
+        """
+        self.snapshot.save_data(self.owner.data)
+        self.journal.clear()
+
+    @persistence
+    def commit(self):
+        if self.journal.entries >= JOURNAL_COMPACT_THRESHOLD:
+            self.save()
+        else:
+            self.journal.commit()
+
+    @persistence
+    def close(self):
+        self.commit()
+        self.journal.close()
+
+
+def open_storage(name):
+    """
+    Returns the storage for the store with the given name: pickles by default, or an SQLite database
+    when the CLIB_STORAGE environment variable is set to 'sqlite'. With 'mmap', the address book is kept
+    in a memory-mapped snapshot, and the note book in pickles.
+    """
+    storage = os.environ.get('CLIB_STORAGE')
+    if storage == 'sqlite':
+        from clib.storage import SqliteStorage
+        return SqliteStorage(name)
+    if storage == 'mmap' and name == 'address_book':
+        from clib.snapshot import SnapshotStorage
+        return SnapshotStorage(name)
+    return PickleStorage(name)
+
+
+class NgramIndex:
+    """
+    Maps every trigram of the indexed texts to the keys of the texts that contain it, so that a substring search
+    only has to check the keys that have all trigrams of the pattern.
+    """
+    size = 3
+
+    def __init__(self):
+        self.postings = {}
+        self.grams_of = {}
+
+    @classmethod
+    def grams(cls, text):
+        return {text[i:i + cls.size] for i in range(len(text) - cls.size + 1)}
+
+    def add(self, key, text):
+        self.discard(key)
+        grams = self.grams(text)
+        self.grams_of[key] = grams
+        for gram in grams:
+            self.postings.setdefault(gram, set()).add(key)
+
+    def discard(self, key):
+        for gram in self.grams_of.pop(key, ()):
+            keys = self.postings[gram]
+            keys.discard(key)
+            if not keys:
+                del self.postings[gram]
+
+    def candidates(self, pattern):
+        """
+        Returns the set of keys whose text may contain the pattern, or None if the pattern is too short for the index.
+        """
+        if len(pattern) < self.size:
+            return None
+        result = None
+        for gram in sorted(self.grams(pattern), key=lambda item: len(self.postings.get(item, ()))):
+            keys = self.postings.get(gram)
+            if not keys:
+                return set()
+            result = set(keys) if result is None else result & keys
+            if not result:
+                break
+        return result
+
+    def sharing(self, text, count):
+        """
+        Returns the set of keys whose text has at least one of the count rarest trigrams of the given text.
+        A text that has lost at most count - 1 of the trigrams of the given text always has one of them.
+        """
+        grams = sorted(self.grams(text), key=lambda item: len(self.postings.get(item, ())))
+        return set().union(*(self.postings.get(gram, ()) for gram in grams[:count]))
+
+
+class ExactIndex:
+    """
+    Maps every value of the indexed keys to the set of keys that have it, so that the keys with a given value
+    are found without looking at the others.
+    """
+
+    def __init__(self):
+        self.postings = {}
+        self.values_of = {}
+
+    def add(self, key, values):
+        self.discard(key)
+        values = frozenset(values)
+        self.values_of[key] = values
+        for value in values:
+            self.postings.setdefault(value, set()).add(key)
+
+    def discard(self, key):
+        for value in self.values_of.pop(key, ()):
+            keys = self.postings[value]
+            keys.discard(key)
+            if not keys:
+                del self.postings[value]
+
+    def get(self, value):
+        return self.postings.get(value, set())
+
+
+class RankedIndex:
+    """
+    Maps every word of the indexed texts to the keys of the texts that contain it and the number of times it occurs
+    there, so that the texts matching a query can be ranked by BM25 looking only at the postings of its words.
+    """
+    k1 = 1.2
+    b = 0.75
+    word = re.compile(r'\w+')
+
     def __init__(self):
+        self.postings = {}
+        self.words_of = {}
+        self.lengths = {}
+        self.total_length = 0
+
+    @classmethod
+    def words(cls, text):
+        return cls.word.findall(text.lower())
+
+    def add(self, key, text):
+        self.discard(key)
+        words = self.words(text)
+        counts = Counter(words)
+        self.words_of[key] = tuple(counts)
+        self.lengths[key] = len(words)
+        self.total_length += len(words)
+        for word, count in counts.items():
+            self.postings.setdefault(word, {})[key] = count
+
+    def discard(self, key):
+        for word in self.words_of.pop(key, ()):
+            keys = self.postings[word]
+            del keys[key]
+            if not keys:
+                del self.postings[word]
+        self.total_length -= self.lengths.pop(key, 0)
+
+    def top(self, query, limit, keys=None):
+        """
+        Returns up to limit keys of the texts that contain words of the query, the highest BM25 score first.
+        When keys is given, only the texts with those keys are ranked.
+        """
+        texts = len(self.lengths)
+        if not texts:
+            return []
+        average_length = self.total_length / texts or 1
+        scores = {}
+        for word in set(self.words(query)):
+            postings = self.postings.get(word)
+            if not postings:
+                continue
+            idf = log(1 + (texts - len(postings) + 0.5) / (len(postings) + 0.5))
+            for key, count in postings.items():
+                if keys is not None and key not in keys:
+                    continue
+                norm = count + self.k1 * (1 - self.b + self.b * self.lengths[key] / average_length)
+                scores[key] = scores.get(key, 0) + idf * count * (self.k1 + 1) / norm
+        return nsmallest(limit, scores, key=lambda key: (-scores[key], key))
+
+
+class AddressBook(UserDict):
+    def __init__(self, storage=None):
         super().__init__()
-        filename = 'address_book.bin'
-        data_loader = DataTransfer(filename)
-        loaded_data = data_loader.load_data()
+        self._order = None
+        self._keys = None
+        self._seqs = None
+        self._next_seq = 0
+        self._name_index = None
+        self._phone_index = None
+        self._number_index = None
+        self._fuzzy_index = None
+        self._birthdays = None
+        self._birthday_ordinals = None
+        self.storage = storage if storage is not None else open_storage('address_book')
+        self.storage.load(self)
 
-        if loaded_data:
-            self.data = loaded_data
+        # a storage that reads the records on demand attaches them to the book itself
+        if isinstance(self.data, dict):
+            for record in self.data.values():
+                record.book = self
+
+    def _apply(self, entry):
+        if entry[0] in ('add', 'set'):
+            self.data[entry[1]] = entry[2]
+        elif entry[0] == 'del':
+            self.data.pop(entry[1], None)
+
+    def _log(self, entry):
+        self.storage.log(entry)
+
+    def _indexed(self):
+        """
+        Tells whether the storage answers the queries of the book itself, with the indexes of a database.
+        """
+        return getattr(self.data, 'indexed', False)
 
     def save_data(self):
-        data_saver = DataTransfer('address_book.bin')
-        data_saver.save_data(self.data)
+        """
+        Saves the whole book at once.
+        """
+        self.storage.save()
+
+    @contextmanager
+    def bulk(self):
+        """
+        Changes many records at once. Inside the block, the changes are not journaled and the indexes are not
+        updated; afterwards the indexes are built again on first use and the whole book is saved at once.
+        """
+        self._order = self._keys = self._seqs = None
+        self._name_index = self._phone_index = None
+        self._number_index = self._fuzzy_index = None
+        self._birthdays = self._birthday_ordinals = None
+        self.storage.bulk = True
+        try:
+            yield self
+        finally:
+            self.storage.bulk = False
+            self.save_data()
+
+    def commit(self):
+        self.storage.commit()
+
+    def close(self):
+        self.storage.close()
 
     def add_record(self, record):
-        self.data[record.name.value] = record
+        name = record.name.value
+        self.data[name] = record
+        record.book = self
+        if self._order is not None and name not in self._order:
+            self._order[name] = self._next_seq
+            self._keys.append(name)
+            self._seqs.append(self._next_seq)
+            self._next_seq += 1
+        if self._name_index is not None:
+            self._index_record(record)
+        if self._number_index is not None:
+            self._number_index.add(name, (phone.number for phone in record.phones))
+        if self._fuzzy_index is not None:
+            self._fuzzy_index.add(name, fuzzy_key(name))
+        if self._birthdays is not None:
+            self._index_birthday(record)
+        self._log(('add', name, record))
 
     def del_record(self, name):
         del self.data[name]
+        if self._order is not None:
+            position = bisect_left(self._seqs, self._order.pop(name))
+            del self._keys[position]
+            del self._seqs[position]
+        if self._name_index is not None:
+            self._name_index.discard(name)
+            self._phone_index.discard(name)
+        if self._number_index is not None:
+            self._number_index.discard(name)
+        if self._fuzzy_index is not None:
+            self._fuzzy_index.discard(name)
+        if self._birthdays is not None:
+            self._unindex_birthday(name)
+        self._log(('del', name))
+
+    def record_changed(self, record, field=None):
+        if self._name_index is not None and field == 'phones':
+            self._phone_index.add(record.name.value, '\n'.join(phone.value for phone in record.phones))
+        if self._number_index is not None and field == 'phones':
+            self._number_index.add(record.name.value, (phone.number for phone in record.phones))
+        if self._birthdays is not None and field == 'birthday':
+            self._index_birthday(record)
+        self._log(('set', record.name.value, record))
+
+    def _ensure_order(self):
+        """
+        Numbers the records in the order of the book on first use. The numbers are kept by the later changes,
+        so the position of a name can be found by bisecting the list of numbers.
+        """
+        if self._order is None:
+            self._keys = list(self.data)
+            self._seqs = list(range(len(self._keys)))
+            self._order = dict(zip(self._keys, self._seqs))
+            self._next_seq = len(self._keys)
+
+    def _index_record(self, record):
+        name = record.name.value
+        self._name_index.add(name, name.lower())
+        self._phone_index.add(name, '\n'.join(phone.value for phone in record.phones))
+
+    def _ensure_index(self):
+        """
+        Builds the search indexes on first use. After that they are kept up to date by every change of the book.
+        """
+        self._ensure_order()
+        if self._name_index is None:
+            self._name_index = NgramIndex()
+            self._phone_index = NgramIndex()
+            for record in self.data.values():
+                self._index_record(record)
+
+    def search(self, pattern):
+        """
+        Returns the records whose name (case-insensitive) or one of the phones contains the pattern,
+        in the order of the book.
+        """
+        if self._indexed():
+            return dict(self.data.search(pattern))
+        self._ensure_index()
+        names = self._name_index.candidates(pattern.lower())
+        phones = self._phone_index.candidates(pattern)
+        if names is None or phones is None:
+            candidates = self.data.keys()
+        else:
+            candidates = sorted(names | phones, key=self._order.__getitem__)
+
+        result = {}
+        for name in candidates:
+            record = self.data[name]
+            if name.lower().find(pattern.lower()) != -1:
+                result[name] = record
+            elif any(phone.value.find(pattern) != -1 for phone in record.phones):
+                result[name] = record
+        return result
+
+    def owners(self, number):
+        """
+        Returns the names of the contacts that have the phone with the given number (see phone_number),
+        in the order of the book.
+        """
+        if self._indexed():
+            return self.data.owners(number)
+        if self._number_index is None:
+            self._number_index = ExactIndex()
+            for name, record in self.data.items():
+                self._number_index.add(name, (phone.number for phone in record.phones))
+        self._ensure_order()
+        return sorted(self._number_index.get(number), key=self._order.__getitem__)
+
+    def _ensure_fuzzy_index(self):
+        """
+        Builds the index of the trigrams of the padded names on first use. It only needs the names, so a storage
+        that reads the records on demand does not have to read them.
+        """
+        if self._fuzzy_index is None:
+            self._fuzzy_index = NgramIndex()
+            for name in self.data:
+                self._fuzzy_index.add(name, fuzzy_key(name))
+
+    def fuzzy_search(self, name, max_distance=2):
+        """
+        Returns (edit distance, name) pairs of the contacts whose name (case-insensitive) is within max_distance
+        edits of the given name, nearest first. Every edit changes at most 3 trigrams of the padded name,
+        so only the names that share one of its 3 * max_distance + 1 rarest trigrams, and all but
+        3 * max_distance of its trigrams, are compared with it.
+        """
+        self._ensure_fuzzy_index()
+        query = fuzzy_key(name)
+        grams = NgramIndex.grams(query)
+        min_shared = len(grams) - 3 * max_distance
+        if min_shared > 0:
+            candidates = self._fuzzy_index.sharing(query, 3 * max_distance + 1)
+        else:
+            candidates = self._fuzzy_index.grams_of.keys()
+
+        found = []
+        grams_of = self._fuzzy_index.grams_of
+        for candidate in candidates:
+            # the difference in length and the number of shared trigrams are cheap lower bounds of the distance
+            if abs(len(candidate) - len(name)) > max_distance or len(grams & grams_of[candidate]) < min_shared:
+                continue
+            distance = edit_distance(name.lower(), candidate.lower(), max_distance)
+            if distance <= max_distance:
+                found.append((distance, candidate))
+        return sorted(found)
+
+    def _index_birthday(self, record):
+        name = record.name.value
+        self._unindex_birthday(name)
+        if record.birthday is not None:
+            self._birthday_ordinals[name] = record.birthday.ordinal
+            insort(self._birthdays, (record.birthday.ordinal, name))
+
+    def _unindex_birthday(self, name):
+        ordinal = self._birthday_ordinals.pop(name, None)
+        if ordinal is not None:
+            del self._birthdays[bisect_left(self._birthdays, (ordinal, name))]
+
+    def _ensure_birthdays(self):
+        """
+        Builds the list of (day of year, name) pairs sorted by the day of year on first use.
+        """
+        if self._birthdays is None:
+            self._birthday_ordinals = {name: record.birthday.ordinal for name, record in self.data.items()
+                                       if record.birthday is not None}
+            self._birthdays = sorted((ordinal, name) for name, ordinal in self._birthday_ordinals.items())
+
+    def _birthday_names(self, first, last):
+        """
+        Returns the names of the contacts whose birthday falls between the given days of year (inclusive).
+        """
+        if self._indexed():
+            return self.data.birthday_names(first, last)
+        self._ensure_birthdays()
+        begin = bisect_left(self._birthdays, (first,))
+        finish = bisect_left(self._birthdays, (last + 1,))
+        return [name for ordinal, name in self._birthdays[begin:finish]]
+
+    def upcoming_birthdays(self, days, today=None):
+        """
+        Returns (days to birthday, name) pairs of the contacts whose birthday is within the given number of days
+        from today (including today), nearest first.
+        """
+        if today is None:
+            today = date.today()
+        end = today + timedelta(days=min(days, 366))
+        found = {}
+        start = today
+        while start <= end:
+            stop = min(end, date(start.year, 12, 31))
+            first, last = day_ordinal(start), day_ordinal(stop)
+            if not isleap(start.year) and last == day_ordinal(date(2001, 2, 28)):
+                last += 1
+            for name in self._birthday_names(first, last):
+                if name not in found:
+                    found[name] = (next_birthday(self.data[name].birthday.date, today) - today).days
+            start = stop + timedelta(days=1)
+        return sorted((days_left, name) for name, days_left in found.items())
+
+    def page(self, page_num, n_records):
+        """
+        Returns the records of the page with the given number (counting from 1).
+        """
+        if page_num < 1:
+            return {}
+        if self._indexed():
+            return dict(self.data.page(page_num, n_records))
+        self._ensure_order()
+        names = self._keys[(page_num - 1) * n_records:page_num * n_records]
+        return {name: self.data[name] for name in names}
+
+    def page_after(self, cursor, n_records):
+        """
+        Returns the page of records that follows the cursor, and the cursor of that page.
+        A cursor of None starts from the beginning. The cursor stays valid when the book is changed.
+        """
+        if self._indexed():
+            return self.data.page_after(cursor, n_records)
+        self._ensure_order()
+        start = 0 if cursor is None else bisect_right(self._seqs, cursor)
+        names = self._keys[start:start + n_records]
+        if not names:
+            return {}, cursor
+        return {name: self.data[name] for name in names}, self._order[names[-1]]
 
     def iterator(self, n_records):
-        page = {}
-        i = 0
-        for name, record in self.data.items():
-            page[name] = record
-            i += 1
-            if i == n_records:
-                yield page
-                page = {}
-                i = 0
-        if page:
+        cursor = None
+        while True:
+            page, cursor = self.page_after(cursor, n_records)
+            if not page:
+                return
             yield page
 
 
 class Record:
+    """
+    A contact. Only its name and one string with the values of the other fields (the birthday, email and address,
+    empty when missing, and then the phones, separated by VALUE_SEPARATOR) are kept; the fields are made of them
+    when they are used. A contact takes three objects instead of one for every field and one for every value.
+    """
+    __slots__ = ('_name', '_values', 'book')
+
     def __init__(self, name, birthday=None, email=None, address=None):
-        self.name = name
-        self.phones = []
-        self.birthday = birthday
-        self.email = email
-        self.address = address
+        self._name = name.value
+        self._values = pack_values(value_of(birthday), value_of(email), value_of(address), ())
+        self.book = None
+
+    def __getstate__(self):
+        return self._name, self._values
+
+    def __setstate__(self, state):
+        # records pickled before __slots__ were introduced keep their state in a dict,
+        # and the ones pickled before the values were packed keep their fields
+        if isinstance(state, dict):
+            state = tuple(state.get(field) for field in ('name', 'phones', 'birthday', 'email', 'address'))
+        if len(state) == 5:
+            name, phones, birthday, email, address = state
+            state = name.value, pack_values(value_of(birthday), value_of(email), value_of(address),
+                                            [phone.value for phone in phones])
+        self._name, self._values = state
+        self.book = None
+
+    @classmethod
+    def restore(cls, name, birthday, email, address, phones):
+        """
+        Creates the record from the values of its fields kept by a storage, None for the missing ones.
+        """
+        record = cls.__new__(cls)
+        record._name = name
+        record._values = pack_values(birthday, email, address, phones)
+        record.book = None
+        return record
+
+    def _value(self, index, field):
+        value = self._values.split(VALUE_SEPARATOR, 3)[index]
+        return field.restore(value) if value else None
+
+    def _set_value(self, index, field):
+        values = self._values.split(VALUE_SEPARATOR, 3)
+        values[index] = value_of(field)
+        self._values = VALUE_SEPARATOR.join(values)
+
+    @property
+    def name(self):
+        return Name.restore(self._name)
+
+    @property
+    def phones(self):
+        """
+        The phones, as a tuple: a phone is added and removed with add_phone and remove_phone, or all of them
+        are replaced by assigning a new sequence.
+        """
+        return tuple(Phone.restore(phone) for phone in self._values.split(VALUE_SEPARATOR)[3:])
+
+    @phones.setter
+    def phones(self, phones):
+        self._values = pack_values(*self._values.split(VALUE_SEPARATOR, 3)[:3], [phone.value for phone in phones])
+
+    @property
+    def birthday(self):
+        return self._value(0, Birthday)
+
+    @birthday.setter
+    def birthday(self, birthday):
+        self._set_value(0, birthday)
+
+    @property
+    def email(self):
+        return self._value(1, Email)
+
+    @email.setter
+    def email(self, email):
+        self._set_value(1, email)
+
+    @property
+    def address(self):
+        return self._value(2, Address)
+
+    @address.setter
+    def address(self, address):
+        self._set_value(2, address)
+
+    def _changed(self, field=None):
+        if self.book is not None:
+            self.book.record_changed(self, field)
 
     def add_phone(self, phone):
-        self.phones.append(phone)
+        self._values += VALUE_SEPARATOR + phone.value
+        self._changed('phones')
 
     def remove_phone(self, rem_phone):
-        for phone in self.phones:
-            if phone.value == rem_phone.value:
-                self.phones.remove(phone)
+        self.phones = [phone for phone in self.phones if phone.number != rem_phone.number]
+        self._changed('phones')
 
     def add_birthday(self, birthday):
         self.birthday = birthday
+        self._changed('birthday')
 
     def add_email(self, email):
         self.email = email
+        self._changed()
 
     def add_address(self, address):
         self.address = address
+        self._changed()
 
     def days_to_birthday(self):
-        birthday = datetime.strptime(self.birthday.value, '%Y-%m-%d').date()
-        today = datetime.now().date()
-        birthday = birthday.replace(year=today.year)
-        if birthday < today:
-            birthday = birthday.replace(year=today.year + 1)
-        return (birthday - today).days
+        today = date.today()
+        return (next_birthday(self.birthday.date, today) - today).days
 
 
 class Field:
+    __slots__ = ('_value',)
+
     def __init__(self, value):
         self._value = None
         self.value = value
 
+    def __getstate__(self):
+        return (self._value,)
+
+    def __setstate__(self, state):
+        # fields pickled before __slots__ were introduced keep their state in a dict
+        self._value = state['_value'] if isinstance(state, dict) else state[0]
+
+    @classmethod
+    def restore(cls, value):
+        """
+        Creates the field from a value that has already been validated when it was stored.
+        """
+        field = cls.__new__(cls)
+        field.__setstate__((value,))
+        return field
+
+    @classmethod
+    def validate_many(cls, values):
+        """
+        Validates the values in one pass. Returns the list of fields made of the values, with None in place
+        of the values that are None or invalid, and a dict of the errors by the index of the invalid values.
+        """
+        fields, errors = [], {}
+        for index, value in enumerate(values):
+            field = None
+            if value is not None:
+                field = cls.__new__(cls)
+                try:
+                    field.value = value
+                except (PhoneInvalidFormatError, BirthdayInvalidFormatError, EmailInvalidFormatError) as error:
+                    errors[index] = error
+                    field = None
+            fields.append(field)
+        return fields, errors
+
     @property
     def value(self):
         return self._value
@@ -104,66 +871,217 @@ class Field:
 
 
 class Name(Field):
-    pass
+    __slots__ = ()
 
 
 class Phone(Field):
+    __slots__ = ('number',)
 
     @Field.value.setter
     def value(self, value):
-        if value.startswith('+') and len(value[1:]) == 12 and value[1:].isdigit() or value.isdigit() and len(value) in \
-                (10, 12):
+        if PHONE_RE.fullmatch(value) is not None:
             self._value = value
+            self.number = phone_number(value)
         else:
             raise PhoneInvalidFormatError('Invalid phone format. Please enter the phone in the format'
                                           ' +000000000000, 000000000000 or 0000000000')
 
+    def __setstate__(self, state):
+        # the number is not pickled, so the phones saved before it was introduced get it as well
+        super().__setstate__(state)
+        self.number = phone_number(self._value)
+
 
 class Birthday(Field):
+    __slots__ = ('date', 'ordinal')
 
     @Field.value.setter
     def value(self, value):
-        today = datetime.now().date()
-        try:
-            birthday = datetime.strptime(value, '%Y-%m-%d').date()
-        except ValueError:
-            birthday = None
-        if birthday is not None and birthday < today:
+        birthday = parse_date(value)
+        if birthday is not None and birthday < date.today():
             self._value = value
+            self.date = birthday
+            self.ordinal = day_ordinal(birthday)
         else:
             raise BirthdayInvalidFormatError('Invalid birthday format. Please enter the birthday'
                                              ' in the format YYYY-MM_DD')
 
+    def __setstate__(self, state):
+        super().__setstate__(state)
+        self.date = parse_date(self._value)
+        self.ordinal = day_ordinal(self.date)
+
 
 class Email(Field):
+    __slots__ = ()
 
     @Field.value.setter
     def value(self, value):
-        pattern = r"[A-Za-z][A-Za-z0-9._]+@[A-Za-z]+\.[A-Za-z]{2,}"
-        if re.match(pattern, value) is not None:
+        if EMAIL_RE.match(value) is not None:
             self._value = value
         else:
             raise EmailInvalidFormatError('Invalid email format')
 
 
-class Notes(UserList):
+class Notes(UserDict):
+    """
+    Note book that keeps the notes by their ids in the order they were added.
+    """
 
-    def __init__(self):
+    def __init__(self, storage=None):
         super().__init__()
+        self.next_id = 0
+        self._tag_index = None
+        self._text_index = None
+        self._rank_index = None
+        self.storage = storage if storage is not None else open_storage('note_book')
+        self.storage.load(self)
 
-        filename = 'note_book.bin'
-        data_loader = DataTransfer(filename)
-        loaded_data = data_loader.load_data()
+        if isinstance(self.data, list):
+            self._migrate()
+        else:
+            self.next_id = max(self.next_id, max(self.data, default=-1) + 1)
 
-        if loaded_data:
-            self.data = loaded_data
+    def _apply(self, entry):
+        # a journal written before the notes had ids addresses them by list position, which works the same way
+        if entry[0] == 'add':
+            if isinstance(self.data, list):
+                self.data.append(entry[1])
+            else:
+                self.data[entry[1].id] = entry[1]
+                self.next_id = max(self.next_id, entry[1].id + 1)
+        elif isinstance(self.data, list):
+            if entry[0] == 'edit':
+                self.data[entry[1]].text = entry[2]
+            elif entry[0] == 'delete':
+                del self.data[entry[1]]
+        # after a crash between writing a snapshot and clearing the journal, the journal is replayed over a snapshot
+        # that already has its changes, so the notes it edits or deletes may be gone
+        elif entry[0] == 'edit':
+            if entry[1] in self.data:
+                self.data[entry[1]].text = entry[2]
+        elif entry[0] == 'delete':
+            self.data.pop(entry[1], None)
+
+    def _migrate(self):
+        """
+        Converts the list of notes saved by older versions into the id-keyed note book.
+        """
+        notes = self.data
+        self.data = {}
+        for note in notes:
+            note.id = self.next_id
+            self.data[note.id] = note
+            self.next_id += 1
+        self.save_data()
+
+    def _log(self, entry):
+        self.storage.log(entry)
 
     def save_data(self):
-        data_saver = DataTransfer('note_book.bin')
-        data_saver.save_data(self.data)
+        """
+        Saves the whole note book at once.
+        """
+        self.storage.save()
+
+    @contextmanager
+    def bulk(self):
+        """
+        Adds or changes many notes at once, like AddressBook.bulk().
+        """
+        self._tag_index = self._text_index = self._rank_index = None
+        self.storage.bulk = True
+        try:
+            yield self
+        finally:
+            self.storage.bulk = False
+            self.save_data()
+
+    def commit(self):
+        self.storage.commit()
+
+    def close(self):
+        self.storage.close()
 
     def add_note(self, note):
-        self.data.append(note)
+        note.id = self.next_id
+        self.next_id += 1
+        self.data[note.id] = note
+        if self._tag_index is not None:
+            self._index_note(note)
+        self._log(('add', note))
+
+    def edit_note(self, note_id, text):
+        note = self.data[note_id]
+        note.text = text
+        if self._text_index is not None:
+            self._text_index.add(note_id, text)
+            self._rank_index.add(note_id, f'{note.title or ""}\n{text}')
+        self._log(('edit', note_id, text))
+
+    def delete_note(self, note_id):
+        note = self.data.pop(note_id)
+        if self._tag_index is not None:
+            for tag in note.tags or ():
+                self._tag_index[tag].discard(note_id)
+            self._text_index.discard(note_id)
+            self._rank_index.discard(note_id)
+        self._log(('delete', note_id))
+
+    def _index_note(self, note):
+        for tag in note.tags or ():
+            self._tag_index.setdefault(tag, set()).add(note.id)
+        self._text_index.add(note.id, note.text)
+        self._rank_index.add(note.id, f'{note.title or ""}\n{note.text}')
+
+    def _ensure_index(self):
+        if self._tag_index is None:
+            self._tag_index = {}
+            self._text_index = NgramIndex()
+            self._rank_index = RankedIndex()
+            for note in self.data.values():
+                self._index_note(note)
+
+    def search(self, text=None, tags=()):
+        """
+        Returns ids of the notes that contain the text and have at least one of the tags, in the order
+        the notes were added. Either condition is skipped when it is not given.
+        """
+        if getattr(self.data, 'indexed', False):
+            return self.data.search(text, tags)
+        self._ensure_index()
+        candidates = None
+        if tags:
+            candidates = set().union(*(self._tag_index.get(tag, ()) for tag in tags))
+        if text:
+            found = self._text_index.candidates(text)
+            if found is not None:
+                candidates = found if candidates is None else candidates & found
+        if candidates is None:
+            candidates = self.data.keys()
+        else:
+            candidates = sorted(candidates)
+
+        result = []
+        for note_id in candidates:
+            note = self.data[note_id]
+            if text and text not in note.text:
+                continue
+            if tags and not any(tag in (note.tags or ()) for tag in tags):
+                continue
+            result.append(note_id)
+        return result
+
+    def rank(self, text, tags=(), limit=10):
+        """
+        Returns ids of up to limit notes whose title or text contain words of the text, the best matches by BM25
+        first. When tags are given, only the notes that have at least one of them are ranked.
+        """
+        if getattr(self.data, 'indexed', False):
+            return self.data.rank(text, tags, limit)
+        self._ensure_index()
+        keys = set().union(*(self._tag_index.get(tag, ()) for tag in tags)) if tags else None
+        return self._rank_index.top(text, limit, keys)
 
 
 class Note:
@@ -172,10 +1090,11 @@ class Note:
         self.text = text
         self.tags = tags
         self.title = title
+        self.id = None
 
 
 class Address(Field):
-    pass
+    __slots__ = ()
 
 
 class PhoneInvalidFormatError(Exception):
@@ -194,5 +1113,22 @@ class NoteInputInvalidFormatError(Exception):
     pass
 
 
-address_book = AddressBook()
-note_book = Notes()
+_stores = {'address_book': AddressBook, 'note_book': Notes}
+
+
+def __getattr__(name):
+    """
+    Loads address_book and note_book on first access, so that commands which do not use a store never load it.
+    """
+    if name in _stores:
+        store = _stores[name]()
+        globals()[name] = store
+        return store
+    raise AttributeError(f'module {__name__!r} has no attribute {name!r}')
+
+
+def is_loaded(name):
+    """
+    Tells whether the store with the given name has already been loaded.
+    """
+    return name in globals()
@@ -0,0 +1,55 @@
+class CommandTrie:
+    """
+    Maps commands of one or more words to their handlers. The words of the commands are kept in a trie,
+    so the longest command that the input starts with is found in one pass over the input words,
+    however many commands there are.
+    """
+
+    def __init__(self, commands=None):
+        self.root = {}
+        self.handlers = {}
+        for command, handler in (commands or {}).items():
+            self.register(command, handler)
+
+    def register(self, command, handler):
+        """
+        Adds a command or replaces the handler of an existing one.
+        """
+        node = self.root
+        for word in command.split(' '):
+            node = node.setdefault(word, {})
+        node[None] = command
+        self.handlers[command] = handler
+
+    def match(self, words):
+        """
+        Returns the longest command made of the first words and the number of words it takes,
+        or (None, 0) if there is no such command.
+        """
+        node = self.root
+        command, length = None, 0
+        for index, word in enumerate(words):
+            node = node.get(word)
+            if node is None:
+                break
+            if None in node:
+                command, length = node[None], index + 1
+        return command, length
+
+    def keys(self):
+        return self.handlers.keys()
+
+    def items(self):
+        return self.handlers.items()
+
+    def __contains__(self, command):
+        return command in self.handlers
+
+    def __getitem__(self, command):
+        return self.handlers[command]
+
+    def __iter__(self):
+        return iter(self.handlers)
+
+    def __len__(self):
+        return len(self.handlers)
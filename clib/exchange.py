@@ -0,0 +1,193 @@
+"""
+Streaming import and export of the address book in CSV and vCard formats.
+
+CSV files have the columns name, phones, birthday, email, address; several phones are separated by ';'.
+"""
+from pathlib import Path
+import csv
+
+from clib import classes
+
+CSV_FIELDS = ['name', 'phones', 'birthday', 'email', 'address']
+VCARD_SUFFIXES = ('.vcf', '.vcard')
+IMPORT_BATCH_SIZE = 1000
+
+
+def file_format(path):
+    suffix = Path(path).suffix.lower()
+    if suffix == '.csv':
+        return 'csv'
+    if suffix in VCARD_SUFFIXES:
+        return 'vcard'
+    raise ValueError(f'Unsupported file format: {suffix}')
+
+
+def read_csv(file):
+    """
+    Yields (row number, contact) pairs, where a contact is a dict of raw strings with the phones as a list.
+    """
+    for number, row in enumerate(csv.DictReader(file), 2):
+        phones = row.get('phones') or ''
+        yield number, {'name': (row.get('name') or '').strip(),
+                       'phones': [phone.strip() for phone in phones.split(';') if phone.strip()],
+                       'birthday': (row.get('birthday') or '').strip() or None,
+                       'email': (row.get('email') or '').strip() or None,
+                       'address': (row.get('address') or '').strip() or None}
+
+
+def unfold(file):
+    """
+    Yields (line number, logical line) pairs of a vCard file, joining the folded continuation lines.
+    """
+    current, start = None, 0
+    for number, line in enumerate(file, 1):
+        line = line.rstrip('\r\n')
+        if line[:1] in (' ', '\t') and current is not None:
+            current += line[1:]
+            continue
+        if current is not None:
+            yield start, current
+        current, start = line, number
+    if current is not None:
+        yield start, current
+
+
+def read_vcard(file):
+    """
+    Yields (line number of BEGIN:VCARD, contact) pairs in the same form as read_csv.
+    """
+    contact, start = None, 0
+    for number, line in unfold(file):
+        key, _, value = line.partition(':')
+        key = key.split(';')[0].upper()
+        if key == 'BEGIN':
+            contact, start = {'name': '', 'phones': [], 'birthday': None, 'email': None, 'address': None}, number
+        elif contact is None:
+            continue
+        elif key == 'END':
+            yield start, contact
+            contact = None
+        elif key == 'FN':
+            contact['name'] = value.strip()
+        elif key == 'TEL':
+            contact['phones'].append(value.strip())
+        elif key == 'BDAY':
+            contact['birthday'] = value.strip() or None
+        elif key == 'EMAIL':
+            contact['email'] = value.strip() or None
+        elif key == 'ADR':
+            contact['address'] = ' '.join(part for part in value.split(';') if part).strip() or None
+
+
+def validate(contacts):
+    """
+    Builds the fields of a batch of (row number, contact) pairs column by column. Returns the list of valid
+    (name, phones, birthday, email, address) field tuples and the list of (row number, error) pairs.
+    """
+    phones, offsets = [], [0]
+    for _, contact in contacts:
+        phones.extend(contact['phones'])
+        offsets.append(len(phones))
+    phone_fields, phone_errors = classes.Phone.validate_many(phones)
+    birthdays, birthday_errors = classes.Birthday.validate_many([contact['birthday'] or None
+                                                                 for _, contact in contacts])
+    emails, email_errors = classes.Email.validate_many([contact['email'] or None for _, contact in contacts])
+
+    valid, errors = [], []
+    for row, (number, contact) in enumerate(contacts):
+        first, last = offsets[row], offsets[row + 1]
+        error = next((phone_errors[index] for index in range(first, last) if index in phone_errors), None)
+        if not contact['name']:
+            error = 'the name is missing'
+        error = error or birthday_errors.get(row) or email_errors.get(row)
+        if error is not None:
+            errors.append((number, str(error)))
+            continue
+        valid.append((classes.Name(contact['name']), phone_fields[first:last], birthdays[row], emails[row],
+                      classes.Address(contact['address']) if contact['address'] else None))
+    return valid, errors
+
+
+def store(address_book, valid):
+    """
+    Adds the validated contacts to the address book. A phone written in another format is not new, so every
+    number is kept once. Contacts that already exist get the new phones, and the other fields are replaced when given.
+    """
+    for name, phones, birthday, email, address in valid:
+        record = address_book.data.get(name.value)
+        if record is None:
+            record = classes.Record(name, birthday, email, address)
+            unique = {}
+            for phone in phones:
+                unique.setdefault(phone.number, phone)
+            record.phones = unique.values()
+            address_book.add_record(record)
+            continue
+        known = {phone.number for phone in record.phones}
+        for phone in phones:
+            if phone.number not in known:
+                record.add_phone(phone)
+                known.add(phone.number)
+        birthday is not None and record.add_birthday(birthday)
+        email is not None and record.add_email(email)
+        address is not None and record.add_address(address)
+
+
+def import_contacts(address_book, path):
+    """
+    Imports contacts from a CSV or vCard file in batches of IMPORT_BATCH_SIZE rows, so memory does not grow
+    with the size of the file. Returns the number of imported contacts and the list of (row number, error) pairs.
+    """
+    reader = read_csv if file_format(path) == 'csv' else read_vcard
+    imported, errors = 0, []
+    with open(path, encoding='utf-8', newline='') as file, address_book.bulk():
+        batch = []
+        for item in reader(file):
+            batch.append(item)
+            if len(batch) == IMPORT_BATCH_SIZE:
+                imported += import_batch(address_book, batch, errors)
+                batch = []
+        imported += import_batch(address_book, batch, errors)
+    return imported, errors
+
+
+def import_batch(address_book, batch, errors):
+    valid, batch_errors = validate(batch)
+    store(address_book, valid)
+    errors.extend(batch_errors)
+    return len(valid)
+
+
+def export_contacts(address_book, path):
+    """
+    Writes the contacts of the address book to a CSV or vCard file record by record and returns their number.
+    """
+    csv_format = file_format(path) == 'csv'
+    exported = 0
+    with open(path, 'w', encoding='utf-8', newline='') as file:
+        if csv_format:
+            writer = csv.writer(file)
+            writer.writerow(CSV_FIELDS)
+            for name, record in address_book.data.items():
+                writer.writerow([name, ';'.join(phone.value for phone in record.phones),
+                                 classes.value_of(record.birthday), classes.value_of(record.email),
+                                 classes.value_of(record.address)])
+                exported += 1
+        else:
+            for name, record in address_book.data.items():
+                file.write(to_vcard(name, record))
+                exported += 1
+    return exported
+
+
+def to_vcard(name, record):
+    lines = ['BEGIN:VCARD', 'VERSION:3.0', f'FN:{name}', f'N:{name};;;;']
+    lines.extend(f'TEL:{phone.value}' for phone in record.phones)
+    if record.birthday is not None:
+        lines.append(f'BDAY:{record.birthday.value}')
+    if record.email is not None:
+        lines.append(f'EMAIL:{record.email.value}')
+    if record.address is not None:
+        lines.append(f'ADR:;;{record.address.value};;;;')
+    lines.append('END:VCARD')
+    return '\r\n'.join(lines) + '\r\n'
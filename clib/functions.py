@@ -1,25 +1,31 @@
-from clib import classes
+from itertools import chain
+import sys
+
+from clib import classes, exchange
+from clib.commands import CommandTrie
+from clib.instrumentation import monitor
+
+OUTPUT_CHUNK_SIZE = 64
+IMPORT_ERRORS_SHOWN = 20
+FOUND_NOTES_SHOWN = 20
+FUZZY_MATCHES_SHOWN = 20
 
 
 def parse(user_input, commands):
     """
-    This function parses user's input into command and arguments.
+    This function parses user's input into command and arguments. The longest command the input starts with wins.
 
     :param user_input: user input -> str
-                        commands -> list
+                        commands -> CommandTrie (or any iterable of commands)
     :return: command -> str (or None), args -> list (or None)
     """
-    command = None
-    for elem in commands:
-        if user_input.startswith(elem):
-            command = elem
-            len_command = len(elem.split(' '))
-            user_input_list = user_input.split(' ')
-            args = user_input_list[len_command:]
-            break
-        if command is None:
-            args = None
-    return command, args
+    if not isinstance(commands, CommandTrie):
+        commands = CommandTrie(dict.fromkeys(commands))
+    user_input_list = user_input.split(' ')
+    command, len_command = commands.match(user_input_list)
+    if command is None:
+        return None, None
+    return command, user_input_list[len_command:]
 
 
 def input_error(func):
@@ -172,6 +178,20 @@ def remove_phone(name, phone):
     return f"{name}'s phone number {phone} has been removed."
 
 
+@input_error
+def who(phone):
+    """
+    This function returns the names of contacts that have a phone number, given in any of the accepted formats.
+
+    :param phone -> str
+    :return str
+    """
+    names = classes.address_book.owners(classes.Phone(phone).number)
+    if not names:
+        return f'There are no contacts with the phone number {phone}.'
+    return f'The phone number {phone} belongs to: {", ".join(names)}'
+
+
 @input_error
 def get_phone(name):
     """
@@ -205,6 +225,24 @@ def get_birthday(name):
                f'birthday:\n{classes.address_book.data[name].days_to_birthday()}\n\n'
 
 
+@input_error
+def upcoming_birthdays(days):
+    """
+    This function returns contacts from address_book whose birthday is within the given number of days
+    from today.
+
+    :param days -> str
+    :return str
+    """
+    found = classes.address_book.upcoming_birthdays(int(days))
+    if not found:
+        return f'There are no birthdays in the next {days} days.'
+    result = f'Birthdays in the next {days} days:'
+    for days_left, name in found:
+        result += f'\n{name} -> {classes.address_book.data[name].birthday.value}, in {days_left} days'
+    return result
+
+
 @input_error
 def get_email(name):
     """
@@ -235,33 +273,80 @@ def get_address(name):
         return f'{name} ->\n--address:\n{address.value}\n\n'
 
 
+def format_record(name, record):
+    """
+    This function formats all contact details of a single record.
+
+    :param: name -> str
+            record -> Record
+    :return: str
+    """
+    phones = '--Phone numbers:\n'
+    if record.phones:
+        for phone in record.phones:
+            phones += f'{phone.value}\n'
+    else:
+        phones += 'No phone numbers to display\n'
+    result = f'\n{name} ->\n{phones}'
+    birthday = record.birthday
+    if birthday is not None:
+        result += f'--birthday:\n{birthday.value}\n--days to birthday:\n{record.days_to_birthday()}\n'
+    email = record.email
+    if email is not None:
+        result += f'--Emails:\n{email.value}\n'
+    address = record.address
+    if address is not None:
+        result += f'--Address:\n{address.value}\n'
+    return result
+
+
+def render_records(data):
+    """
+    This generator formats the records of the given data lazily, one record at a time.
+
+    :param: data -> dict
+    :return: generator of str
+    """
+    for name, record in data.items():
+        yield format_record(name, record)
+
+
+def print_output(output, stream=None):
+    """
+    This function prints the output of a command. A string is printed at once, any other iterable of strings
+    is written in chunks of OUTPUT_CHUNK_SIZE parts as soon as they are formatted.
+
+    :param: output -> str or iterable of str
+            stream -> file-like object (sys.stdout by default)
+    """
+    if stream is None:
+        stream = sys.stdout
+    if isinstance(output, str) or output is None:
+        print(output, file=stream)
+        return
+    chunk = []
+    for part in output:
+        chunk.append(part)
+        if len(chunk) == OUTPUT_CHUNK_SIZE:
+            stream.write(''.join(chunk))
+            chunk.clear()
+    chunk.append('\n')
+    stream.write(''.join(chunk))
+    stream.flush()
+
+
 @input_error
-def show_all(data=classes.address_book.data):
+def show_all(data=None):
     """
     This function returns all contact details from the given data. If data is not provided, then data = address_book.
+    The details are formatted lazily, record by record.
 
     :param: data -> dict
-    :return: phone_book -> str
-    """
-    phone_book = ''
-    for name, info in data.items():
-        phones = '--Phone numbers:\n'
-        if data[name].phones:
-            for phone in data[name].phones:
-                phones += f'{phone.value}\n'
-        else:
-            phones += 'No phone numbers to display\n'
-        phone_book += f'\n{name} ->\n{phones}'
-        birthday = data[name].birthday
-        if birthday is not None:
-            phone_book += f'--birthday:\n{birthday.value}\n--days to birthday:\n{data[name].days_to_birthday()}\n'
-        email = data[name].email
-        if email is not None:
-            phone_book += f'--Emails:\n{email.value}\n'
-        address = data[name].address
-        if address is not None:
-            phone_book += f'--Address:\n{address.value}\n'
-    return phone_book
+    :return: phone_book -> generator of str
+    """
+    if data is None:
+        data = classes.address_book.data
+    return render_records(data)
 
 
 @input_error
@@ -272,13 +357,12 @@ def show_page(page_to_show, n_records='3'):
 
     :param: page_to_show -> str
             n_records -> str
-    :return: phone_book -> str
+    :return: phone_book -> generator of str
     """
-    page_num = 1
-    for page in classes.address_book.iterator(int(n_records)):
-        if page_num == int(page_to_show):
-            return f'page {page_num}\n{show_all(page)}'
-        page_num += 1
+    page = classes.address_book.page(int(page_to_show), int(n_records))
+    if page:
+        return chain([f'page {page_to_show}\n'], render_records(page))
+    return f'There is no page {page_to_show}.'
 
 
 @input_error
@@ -288,22 +372,72 @@ def search_contact(pattern):
     given as a parameter pattern.
 
     :param: pattern -> str
-    :return: result -> str
+    :return: result -> generator of str (or str if nothing is found)
     """
-    result = dict()
-    for name, record in classes.address_book.data.items():
-        if name.lower().find(pattern.lower()) != -1:
-            result[name] = record
-        elif record.phones:
-            for phone in record.phones:
-                if phone.value.find(pattern) != -1:
-                    result[name] = record
+    result = classes.address_book.search(pattern)
     if result:
-        return show_all(result)
+        return render_records(result)
     else:
         return f'There are no contacts that match {pattern}.'
 
 
+@input_error
+def fuzzy_search_contact(name, max_distance='2'):
+    """
+    This function returns the names of contacts that differ from the given name by at most max_distance
+    typos (inserted, deleted or replaced letters), the closest first.
+
+    :param: name -> str
+    :param: max_distance -> str
+    :return: result -> str
+    """
+    found = classes.address_book.fuzzy_search(name, int(max_distance))
+    if not found:
+        return f'There are no contacts similar to {name}.'
+    result = f'Contacts similar to {name}:'
+    for distance, similar_name in found[:FUZZY_MATCHES_SHOWN]:
+        result += f'\n{similar_name} -> {distance} typo(s)'
+    return result
+
+
+def import_contacts(*path_args):
+    """
+    This function imports contacts from a CSV or vCard file into address_book. Rows with invalid data are skipped
+    and reported.
+
+    :param path_args: path to the file -> str
+    :return: str
+    """
+    path = ' '.join(path_args)
+    try:
+        imported, errors = exchange.import_contacts(classes.address_book, path)
+    except (OSError, ValueError) as error:
+        return f'Unable to import contacts: {error}'
+    result = f'{imported} rows have been imported from {path}.'
+    if errors:
+        result += f'\n{len(errors)} rows have not been imported:'
+        for number, error in errors[:IMPORT_ERRORS_SHOWN]:
+            result += f'\nrow {number}: {error}'
+        if len(errors) > IMPORT_ERRORS_SHOWN:
+            result += f'\n... and {len(errors) - IMPORT_ERRORS_SHOWN} more'
+    return result
+
+
+def export_contacts(*path_args):
+    """
+    This function exports all contacts from address_book into a CSV or vCard file.
+
+    :param path_args: path to the file -> str
+    :return: str
+    """
+    path = ' '.join(path_args)
+    try:
+        exported = exchange.export_contacts(classes.address_book, path)
+    except (OSError, ValueError) as error:
+        return f'Unable to export contacts: {error}'
+    return f'{exported} contacts have been exported to {path}.'
+
+
 def greeting():
     return 'Hello! How can I help you?'
 
@@ -312,9 +446,28 @@ def end():
     return 'Good bye! Thank you for using CLIB.'
 
 
+def show_stats():
+    """
+    This function returns the time and memory statistics of the commands run so far, when clib has been started
+    with --stats.
+
+    :return: str
+    """
+    if not monitor.enabled:
+        return "The statistics are not collected. Start CLIB with 'clib --stats' to collect them."
+    return monitor.report()
+
+
+def commit_changes():
+    for store in ('address_book', 'note_book'):
+        if classes.is_loaded(store):
+            getattr(classes, store).commit()
+
+
 def write_file():
-    classes.address_book.save_data()
-    classes.note_book.save_data()
+    for store in ('address_book', 'note_book'):
+        if classes.is_loaded(store):
+            getattr(classes, store).close()
 
 
 def get_help():
@@ -337,12 +490,19 @@ def get_help():
     print("get email <name>".ljust(40), "to get the email of a specified contact".rjust(80))
     print("get address <name>".ljust(40), "to get the address of a specified contact".rjust(80))
     print("get birthday <name>".ljust(40), "to get the birthday of a specified contact".rjust(80))
+    print("birthdays <number of days>".ljust(40), "to get the contacts whose birthday is within the given "
+                                                  "number of days".rjust(80))
     print("show <name> or <phone number>".ljust(40), "to get the needed contact details".rjust(80))
+    print("who <phone number>".ljust(40), "to find the contacts that have the phone number in any format".rjust(80))
+    print("find fuzzy <name> [max typos]".ljust(40), "to find the contacts whose name differs from the given one "
+                                                     "by a few typos".rjust(80))
     print("delete phone <name> <phone number>".ljust(40), "to delete a phone number of a specified contact".rjust(80))
     print("delete <name>".ljust(40), "to permanently delete a specified contact from the Book of Contacts".rjust(80))
     print("show all".ljust(40), "to see all the contact details in your Book of Contacts".rjust(80))
-    print("show page <name> <phone number>".ljust(40), "to return contacts from address_book from a "
-                                                        "given page number".rjust(80))
+    print("import <file.csv or file.vcf>".ljust(40), "to add the contacts from a CSV or vCard file".rjust(80))
+    print("export <file.csv or file.vcf>".ljust(40), "to save all the contacts to a CSV or vCard file".rjust(80))
+    print("show page <page number> <records per page>".ljust(40), "to return contacts from address_book from a "
+                                                                   "given page number".rjust(80))
 
     print("".center(120, "_"))
 
@@ -357,8 +517,14 @@ def get_help():
 
     print("General Commands".center(120, "-"))
     print("hello / hi".ljust(40), "to greet CLIB".rjust(80))
+    print("stats".ljust(40), "to see the time and memory used by the commands (run 'clib --stats')".rjust(80))
     print("sort <path to a folder>".ljust(40), "sorts all the files and puts them into "
                                                            "folders depending on file extensions".rjust(80))
+    print("sort --workers <number> <path>".ljust(40), "sorts the files using several threads and "
+                                                      "processes".rjust(80))
+    print("sort --dry-run <path>".ljust(40), "prints out the planned moves without moving the files".rjust(80))
+    print("sort --full <path>".ljust(40), "sorts the files rescanning the folders that have not changed".rjust(80))
+    print("sort --dedup skip|link <path>".ljust(40), "moves byte-identical files only once".rjust(80))
 
     print("goodbye, close, or exit".ljust(40), "to quit the program and terminate the Command Line Interface "
                                                 "Bot".rjust(80))
@@ -368,13 +534,13 @@ def get_help():
     return ""
 
 
-def select_notes(*args):
+def parse_note_query(*args):
     """
-    Retrieves a list of previously added notes by typing in a tag or a keyword.
+    Splits the words typed after a note command into the text to search for and the tags.
 
     :param args: any tags or keywords -> str
-    :return: notes that contain a tag or keyword provided in *args
-    :rtype: list
+    :return: the text (or None) and the list of tags
+    :rtype: tuple
     """
     try:
         text_for_search = args[0]
@@ -383,7 +549,6 @@ def select_notes(*args):
 
     tags = []
     title = ''
-    found_notes = []
 
     if text_for_search.startswith('#'):
         tags.append(text_for_search)
@@ -399,29 +564,26 @@ def select_notes(*args):
         else:
             text_for_search += f' {item}'
 
-    for index, note in enumerate(classes.note_book.data):
-        if text_for_search:
-            if text_for_search in note.text:
-                if tags:
-                    if len(tags) > 1:
-                        for tag in tags:
-                            if tag in note.tags:
-                                found_notes.append([note, note.title, index])
-                                break
-                    elif tags[0] in note.tags:
-                        found_notes.append([note, note.title, index])
-                else:
-                    found_notes.append([note, note.title, index])
-            else:
-                continue
-        else:
-            if len(tags) > 1:
-                for tag in tags:
-                    if tag in note.tags:
-                        found_notes.append([note, note.title, index])
-                        break
-            elif tags[0] in note.tags:
-                found_notes.append([note, note.title, index])
+    if not text_for_search and not tags:
+        raise classes.NoteInputInvalidFormatError
+
+    return text_for_search, tags
+
+
+def select_notes(*args):
+    """
+    Retrieves a list of previously added notes by typing in a tag or a keyword.
+
+    :param args: any tags or keywords -> str
+    :return: notes that contain a tag or keyword provided in *args
+    :rtype: list
+    """
+    text_for_search, tags = parse_note_query(*args)
+    found_notes = []
+
+    for note_id in classes.note_book.search(text_for_search, tags):
+        note = classes.note_book.data[note_id]
+        found_notes.append([note, note.title, note_id])
     return found_notes
 
 
@@ -460,21 +622,31 @@ def add_note(*args):
 @input_error
 def find_note(*args):
     """
-    Returns a list of notes that contain a keyword provided by the user.
+    Returns a list of notes that contain a keyword provided by the user. The notes that contain the words
+    of the keyword are ranked by BM25 and shown first, at most FOUND_NOTES_SHOWN notes in total.
 
     :param args: a keyword by which you want to search the notes -> str
     :return: a list of notes
     :rtype: str
     """
-    found_notes = select_notes(*args)
+    text_for_search, tags = parse_note_query(*args)
+    found_ids = classes.note_book.rank(text_for_search, tags, FOUND_NOTES_SHOWN) if text_for_search else []
+
+    # the notes that contain the text only as a part of a word follow the ranked ones
+    if len(found_ids) < FOUND_NOTES_SHOWN:
+        ranked = set(found_ids)
+        for note in sorted(select_notes(*args), key=lambda x: x[1]):
+            if note[2] not in ranked and len(found_ids) < FOUND_NOTES_SHOWN:
+                found_ids.append(note[2])
+    found_notes = [classes.note_book.data[note_id] for note_id in found_ids]
 
     if found_notes:
         if len(found_notes) == 1:
-            return f"Found note:{found_notes[0][0].title}\n{found_notes[0][0].text}"
+            return f"Found note:{found_notes[0].title}\n{found_notes[0].text}"
         else:
             result = "Found notes:"
-            for note in sorted(found_notes, key=lambda x: x[1]):
-                result += f'\n{note[0].title}\n{note[0].text}'
+            for note in found_notes:
+                result += f'\n{note.title}\n{note.text}'
             return result
     else:
         return "No notes match your search criteria."
@@ -493,7 +665,7 @@ def delete_note(*args):
 
     if found_notes:
         if len(found_notes) == 1:
-            del classes.note_book.data[found_notes[0][2]]
+            classes.note_book.delete_note(found_notes[0][2])
             result = f'Deleted note:\n{found_notes[0][0].title}\n{found_notes[0][0].text}'
         else:
             sorted_found_notes = sorted(found_notes, key=lambda x: x[1])
@@ -513,11 +685,11 @@ def delete_note(*args):
             if choice == '0':
                 result = "Deletion has been canceled."
             elif choice == 'a' or choice == 'A':
-                for index in range(len(found_notes) - 1, -1, -1):
-                    del classes.note_book.data[found_notes[index][2]]
+                for note in found_notes:
+                    classes.note_book.delete_note(note[2])
                 result = "All notes have been deleted."
             elif choice.isdigit() and (1 <= int(choice) <= len(found_notes)):
-                del classes.note_book.data[sorted_found_notes[int(choice) - 1][2]]
+                classes.note_book.delete_note(sorted_found_notes[int(choice) - 1][2])
                 result = f"Note #{choice} has been deleted."
             else:
                 result = "Invalid command. Deletion has been canceled."
@@ -543,7 +715,7 @@ def edit_note(*args):
                              f'{found_notes[0][0].text}\n'
                              f"Type a new note text (Enter to cancel): ")
             if new_text:
-                classes.note_book.data[found_notes[0][2]].text = new_text
+                classes.note_book.edit_note(found_notes[0][2], new_text)
                 result = "The note has been edited"
             else:
                 result = "The note has not been changed"
@@ -562,7 +734,7 @@ def edit_note(*args):
             elif choice.isdigit() and (1 <= int(choice) <= len(found_notes)):
                 new_text = input('Type a new note text (Enter to cancel): ')
                 if new_text:
-                    classes.note_book.data[sorted_found_notes[int(choice) - 1][2]].text = new_text
+                    classes.note_book.edit_note(sorted_found_notes[int(choice) - 1][2], new_text)
                     result = f'Note #{choice} has been edited.'
             else:
                 result = "Incorrect selection. Notes have not been edited."
@@ -0,0 +1,167 @@
+"""
+Opt-in measurements of the commands: wall time, CPU time and peak memory of every command, and the time spent
+parsing it, running the handler, printing the output and writing the changes to the storage.
+The measurements are only taken after monitor.enable() (clib --stats).
+"""
+import cProfile
+import math
+import os
+import time
+import tracemalloc
+from collections import namedtuple
+from contextlib import contextmanager
+from functools import wraps
+
+PHASES = ('parse', 'handler', 'render', 'persist')
+HISTOGRAM_BOUNDS_MS = (1, 10, 100, 1000)
+HISTOGRAM_WIDTH = 40
+
+Sample = namedtuple('Sample', 'wall cpu peak phases')
+
+
+class Monitor:
+    """
+    Collects a sample for every command run between begin() and end(). The phases do not overlap: the time spent
+    persisting the changes is taken out of the phase that caused it. When profile_threshold (in milliseconds)
+    is set, every command is profiled, and the profile of a command that took longer is saved to profile_dir.
+    """
+
+    def __init__(self):
+        self.enabled = False
+        self.profile_threshold = None
+        self.profile_dir = '.'
+        self.samples = {}
+        self.command = None
+        self._phases = None
+        self._phase = None
+        self._started = None
+        self._cpu_started = None
+        self._memory_started = 0
+        self._profiler = None
+        self._persisting = False
+
+    def enable(self, profile_threshold=None, profile_dir='.'):
+        self.enabled = True
+        self.profile_threshold = profile_threshold
+        self.profile_dir = profile_dir
+        if not tracemalloc.is_tracing():
+            tracemalloc.start()
+
+    def disable(self):
+        self.enabled = False
+        self._started = None
+        if tracemalloc.is_tracing():
+            tracemalloc.stop()
+
+    def begin(self):
+        if not self.enabled:
+            return
+        self.command = None
+        self._phases = dict.fromkeys(PHASES, 0.0)
+        tracemalloc.reset_peak()
+        self._memory_started = tracemalloc.get_traced_memory()[0]
+        if self.profile_threshold is not None:
+            self._profiler = cProfile.Profile()
+            self._profiler.enable()
+        self._cpu_started = time.process_time()
+        self._started = time.perf_counter()
+
+    def end(self):
+        if self._started is None:
+            return
+        wall = time.perf_counter() - self._started
+        cpu = time.process_time() - self._cpu_started
+        self._started = None
+        command = self.command or 'unknown command'
+        # the peak of the command itself, without the memory that was already in use when it started
+        peak = tracemalloc.get_traced_memory()[1] - self._memory_started
+        self.samples.setdefault(command, []).append(Sample(wall, cpu, peak, self._phases))
+        if self._profiler is not None:
+            self._profiler.disable()
+            if wall * 1000 >= self.profile_threshold:
+                self._dump_profile(command)
+            self._profiler = None
+
+    def _dump_profile(self, command):
+        os.makedirs(self.profile_dir, exist_ok=True)
+        filename = f'clib-{command.replace(" ", "-")}-{time.time_ns()}.pstats'
+        self._profiler.dump_stats(os.path.join(self.profile_dir, filename))
+
+    @contextmanager
+    def phase(self, name):
+        if self._started is None:
+            yield
+            return
+        outer, self._phase = self._phase, name
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self._phases[name] += time.perf_counter() - started
+            self._phase = outer
+
+    def add_persist_time(self, seconds):
+        self._phases['persist'] += seconds
+        if self._phase is not None:
+            self._phases[self._phase] -= seconds
+
+    def report(self):
+        """
+        Returns the statistics of every command with a histogram of its wall times.
+        """
+        if not self.samples:
+            return 'No commands have been measured yet.'
+        lines = []
+        for command, samples in sorted(self.samples.items()):
+            walls = sorted(sample.wall * 1000 for sample in samples)
+            lines.append(f'{command}: {len(samples)} run(s), wall p50 {percentile(walls, 0.5):.2f} ms, '
+                         f'p90 {percentile(walls, 0.9):.2f} ms, max {walls[-1]:.2f} ms, '
+                         f'cpu {sum(sample.cpu for sample in samples) / len(samples) * 1000:.2f} ms, '
+                         f'peak memory {max(sample.peak for sample in samples) / 1024:.1f} KB')
+            means = {phase: sum(sample.phases[phase] for sample in samples) / len(samples) for phase in PHASES}
+            lines.append('  ' + ', '.join(f'{phase} {mean * 1000:.2f} ms' for phase, mean in means.items()))
+            lines.extend(histogram(walls))
+        return '\n'.join(lines)
+
+
+def percentile(values, fraction):
+    """
+    Returns the value below which the given fraction of the sorted values lies (nearest rank).
+    """
+    return values[min(len(values) - 1, max(0, math.ceil(fraction * len(values)) - 1))]
+
+
+def histogram(walls):
+    """
+    Returns the lines of a histogram of the wall times (in milliseconds) over the HISTOGRAM_BOUNDS_MS buckets.
+    """
+    counts = [0] * (len(HISTOGRAM_BOUNDS_MS) + 1)
+    for wall in walls:
+        counts[sum(wall >= bound for bound in HISTOGRAM_BOUNDS_MS)] += 1
+    labels = [f'< {bound} ms' for bound in HISTOGRAM_BOUNDS_MS] + [f'>= {HISTOGRAM_BOUNDS_MS[-1]} ms']
+    most = max(counts)
+    return [f'  {label.ljust(11)} {"#" * round(count / most * HISTOGRAM_WIDTH)} {count}'
+            for label, count in zip(labels, counts) if count]
+
+
+def persistence(method):
+    """
+    Adds the time spent in the decorated storage method to the persist phase of the current command.
+    """
+
+    @wraps(method)
+    def inner(*args, **kwargs):
+        if monitor._started is None or monitor._persisting:
+            return method(*args, **kwargs)
+        monitor._persisting = True
+        started = time.perf_counter()
+        try:
+            return method(*args, **kwargs)
+        finally:
+            monitor._persisting = False
+            monitor.add_persist_time(time.perf_counter() - started)
+
+    return inner
+
+
+monitor = Monitor()
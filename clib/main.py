@@ -1,55 +1,142 @@
-from clib import functions
+import argparse
+import sys
+
+from clib import classes, functions
+from clib.commands import CommandTrie
+from clib.instrumentation import monitor
 from clib.sort import main as sort
 
+handler_commands = CommandTrie({'hello': functions.greeting,
+                                'hi': functions.greeting,
+                                'add birthday': functions.add_birthday,
+                                'add email': functions.add_email,
+                                'add address': functions.add_address,
+                                'change phone': functions.change_contact,
+                                'get phone': functions.get_phone,
+                                'who': functions.who,
+                                'get birthday': functions.get_birthday,
+                                'birthdays': functions.upcoming_birthdays,
+                                'get email': functions.get_email,
+                                'get address': functions.get_address,
+                                'delete phone': functions.remove_phone,
+                                'show all': functions.show_all,
+                                'show page': functions.show_page,
+                                'good bye': functions.end,
+                                'add note': functions.add_note,
+                                'find note': functions.find_note,
+                                'find fuzzy': functions.fuzzy_search_contact,
+                                'delete note': functions.delete_note,
+                                'edit note': functions.edit_note,
+                                'add': functions.add_contact,
+                                'sort': sort,
+                                'import': functions.import_contacts,
+                                'export': functions.export_contacts,
+                                'help': functions.get_help,
+                                'stats': functions.show_stats,
+                                'delete': functions.del_contact,
+                                'show': functions.search_contact,
+                                'exit': functions.end,
+                                'close': functions.end,
+                                })
+
+
+def register_command(command, handler):
+    """
+    Adds a new command (one or more words) to CLIB. The handler gets the words that follow the command as arguments.
+    """
+    handler_commands.register(command, handler)
+
+
+def execute(user_input):
+    """
+    Runs a single command and returns its output.
+    """
+    with monitor.phase('parse'):
+        if user_input.lower() in handler_commands:
+            command, args = user_input.lower(), ()
+        else:
+            command, args = functions.parse(user_input, handler_commands)
+    monitor.command = command
+    if command:
+        with monitor.phase('handler'):
+            return handler_commands[command](*args)
+    return "Unknown command. Please type 'help' to get the full list of available commands."
+
+
+def run_command(user_input, quiet=False):
+    """
+    Runs a single command and prints its output, unless quiet is set. When the instrumentation is enabled,
+    the command is measured from parsing to printing.
+    """
+    monitor.begin()
+    output = execute(user_input)
+    if not quiet:
+        with monitor.phase('render'):
+            functions.print_output(output)
+    monitor.end()
+    return output
+
+
+def run_batch(lines, quiet=False, commit_every=0):
+    """
+    Runs the commands given one per line in a single process. The changes are written to the journals
+    once at the end, or after every commit_every commands.
+    """
+    classes.Journal.deferred = True
+    try:
+        for number, line in enumerate(lines, 1):
+            user_input = line.rstrip('\r\n')
+            if not user_input.strip():
+                continue
+            output = run_command(user_input, quiet)
+            if output == 'Good bye! Thank you for using CLIB.':
+                break
+            if commit_every and number % commit_every == 0:
+                functions.commit_changes()
+    finally:
+        functions.write_file()
+        classes.Journal.deferred = False
+
+
+def parse_arguments(argv):
+    parser = argparse.ArgumentParser(prog='clib', description='The Command Line Interface Bot.')
+    parser.add_argument('--batch', metavar='FILE',
+                        help="run the commands from FILE (or standard input for '-') instead of prompting")
+    parser.add_argument('--commit-every', metavar='N', type=int, default=0,
+                        help='in batch mode, write the changes after every N commands instead of only at the end')
+    parser.add_argument('--quiet', action='store_true', help='in batch mode, do not print the output of commands')
+    parser.add_argument('--stats', action='store_true',
+                        help="measure the time and memory of every command; see them with the 'stats' command")
+    parser.add_argument('--profile-over', metavar='MS', type=float,
+                        help='profile the commands and save the profile of every command slower than MS milliseconds '
+                             '(implies --stats)')
+    parser.add_argument('--profile-dir', metavar='DIR', default='.', help='folder for the saved profiles')
+    return parser.parse_args(argv)
 
-def main():
+
+def main(argv=None):
     """
     This function implements all the logic of interaction with the user, all 'print' and 'input' takes place here.
     """
-    handler_commands = {'hello': functions.greeting,
-                        'hi': functions.greeting,
-                        'add birthday': functions.add_birthday,
-                        'add email': functions.add_email,
-                        'add address': functions.add_address,
-                        'change phone': functions.change_contact,
-                        'get phone': functions.get_phone,
-                        'get birthday': functions.get_birthday,
-                        'get email': functions.get_email,
-                        'get address': functions.get_address,
-                        'delete phone': functions.remove_phone,
-                        'show all': functions.show_all,
-                        'show page': functions.show_page,
-                        'good bye': functions.end,
-                        'add note': functions.add_note,
-                        'find note': functions.find_note,
-                        'delete note': functions.delete_note,
-                        'edit note': functions.edit_note,
-                        'add': functions.add_contact,
-                        'sort': sort,
-                        'help': functions.get_help,
-                        'delete': functions.del_contact,
-                        'show': functions.search_contact,
-                        'exit': functions.end,
-                        'close': functions.end,
-                        }
+    arguments = parse_arguments(argv)
+    if arguments.stats or arguments.profile_over is not None:
+        monitor.enable(arguments.profile_over, arguments.profile_dir)
+    if arguments.batch == '-':
+        run_batch(sys.stdin, arguments.quiet, arguments.commit_every)
+        return
+    if arguments.batch:
+        with open(arguments.batch, encoding='utf-8') as file:
+            run_batch(file, arguments.quiet, arguments.commit_every)
+        return
 
     print("Welcome! I'm CLI - your personal Command Line Interface Bot.")
     print("Please enter your command or type 'help' to see the full list of available commands.")
 
     while True:
-        user_input = input('Enter command: ')
-        if user_input.lower() in handler_commands.keys():
-            output = handler_commands[user_input.lower()]()
-            print(output)
-            if output == 'Good bye! Thank you for using CLIB.':
-                functions.write_file()
-                exit()
-        else:
-            command, args = functions.parse(user_input, handler_commands.keys())
-            if command:
-                print(handler_commands[command](*args))
-            else:
-                print("Unknown command. Please type 'help' to get the full list of available commands.")
+        output = run_command(input('Enter command: '))
+        if output == 'Good bye! Thank you for using CLIB.':
+            functions.write_file()
+            exit()
 
 
 if __name__ == '__main__':
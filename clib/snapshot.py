@@ -0,0 +1,302 @@
+"""
+A read-only snapshot format for the address book, which is memory-mapped instead of unpickled, so that opening
+a large book does not build all of its records.
+
+A snapshot file (<name>.snap) starts with the header (MAGIC, VERSION and the number of records), followed by:
+
+    offsets  number of records + 1 unsigned 64-bit offsets of the records in the pool, in the order of the book
+    by_name  unsigned 32-bit positions of the records, sorted by name, to find a name by bisection
+    pool     every record as the number of its strings, their lengths (-1 for a missing field) and their
+             UTF-8 bytes: the name, birthday, email, address and then the phones
+
+All numbers are little-endian.
+"""
+import mmap
+import os
+import struct
+from collections.abc import MutableMapping
+from pathlib import Path
+
+from clib import classes
+from clib.instrumentation import persistence
+from clib.storage import RecordItems, RecordValues
+
+MAGIC = b'CLIBSNAP'
+VERSION = 1
+HEADER = struct.Struct('<8sII')
+OFFSET = struct.Struct('<Q')
+BOUNDS = struct.Struct('<QQ')
+POSITION = struct.Struct('<I')
+FIRST_STRING = struct.Struct('<Ii')
+
+
+def encode(text):
+    return text.encode('utf-8', 'surrogatepass')
+
+
+def encode_record(record):
+    fields = (record.name, record.birthday, record.email, record.address, *record.phones)
+    strings = [None if field is None else encode(field.value) for field in fields]
+    lengths = [-1 if string is None else len(string) for string in strings]
+    return struct.pack(f'<I{len(lengths)}i', len(lengths), *lengths) + b''.join(filter(None, strings))
+
+
+def write_snapshot(filename, entries, snapshot=None):
+    """
+    Writes a snapshot of the (name, source) entries, in the order of the book. The source is either an encoded
+    record or the position of a record in the given snapshot, which is copied without decoding it.
+    """
+    entries = list(entries)
+    # the UTF-8 bytes of the names are in the same order as the names themselves
+    by_name = sorted(range(len(entries)), key=lambda position: entries[position][0])
+    offsets = [0]
+    for name, source in entries:
+        offsets.append(offsets[-1] + (snapshot.size(source) if isinstance(source, int) else len(source)))
+    with open(filename, 'wb') as file:
+        file.write(HEADER.pack(MAGIC, VERSION, len(entries)))
+        file.write(struct.pack(f'<{len(offsets)}Q', *offsets))
+        file.write(struct.pack(f'<{len(by_name)}I', *by_name))
+        for name, source in entries:
+            file.write(snapshot.blob(source) if isinstance(source, int) else source)
+
+
+class Snapshot:
+    """
+    A snapshot file mapped into memory. Nothing is read from it until a record is asked for.
+    """
+
+    def __init__(self, filename):
+        self._file = open(filename, 'rb')
+        self.buffer = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, version, self.count = HEADER.unpack_from(self.buffer)
+        if magic != MAGIC or version != VERSION:
+            self.close()
+            raise ValueError(f'{filename} is not a snapshot of version {VERSION}')
+        self._by_name = HEADER.size + OFFSET.size * (self.count + 1)
+        self._pool = self._by_name + POSITION.size * self.count
+
+    def close(self):
+        self.buffer.close()
+        self._file.close()
+
+    def _bounds(self, position):
+        start, end = BOUNDS.unpack_from(self.buffer, HEADER.size + OFFSET.size * position)
+        return self._pool + start, self._pool + end
+
+    def size(self, position):
+        start, end = self._bounds(position)
+        return end - start
+
+    def blob(self, position):
+        start, end = self._bounds(position)
+        return self.buffer[start:end]
+
+    def name_bytes(self, position):
+        start = self._bounds(position)[0]
+        count, length = FIRST_STRING.unpack_from(self.buffer, start)
+        start += POSITION.size * (count + 1)
+        return self.buffer[start:start + length]
+
+    def name(self, position):
+        return str(self.name_bytes(position), 'utf-8', 'surrogatepass')
+
+    def strings(self, position):
+        start, end = self._bounds(position)
+        count = POSITION.unpack_from(self.buffer, start)[0]
+        lengths = struct.unpack_from(f'<{count}i', self.buffer, start + POSITION.size)
+        data = self.buffer[start + POSITION.size * (count + 1):end]
+        text = str(data, 'utf-8', 'surrogatepass')
+        # the lengths are in bytes, so the decoded text can only be cut by them when it is all ASCII
+        ascii = len(text) == len(data)
+        strings = []
+        start = 0
+        for length in lengths:
+            if length < 0:
+                strings.append(None)
+                continue
+            strings.append(text[start:start + length] if ascii else
+                           str(data[start:start + length], 'utf-8', 'surrogatepass'))
+            start += length
+        return strings
+
+    def find(self, name):
+        """
+        Returns the position of the record with the name, or None if there is no such record.
+        """
+        key = encode(name)
+        low, high = 0, self.count
+        while low < high:
+            middle = (low + high) // 2
+            if self.name_bytes(self._ranked(middle)) < key:
+                low = middle + 1
+            else:
+                high = middle
+        if low < self.count and self.name_bytes(self._ranked(low)) == key:
+            return self._ranked(low)
+        return None
+
+    def _ranked(self, rank):
+        return POSITION.unpack_from(self.buffer, self._by_name + POSITION.size * rank)[0]
+
+
+class SnapshotRecords(MutableMapping):
+    """
+    Maps names to the records of a snapshot and the changes made since. The snapshot itself is never changed:
+    the added and changed records are kept in memory, and the deleted names are remembered, until the next
+    snapshot is written. The records of the snapshot are decoded on every access, so unused ones take no memory.
+    """
+
+    def __init__(self, snapshot, book):
+        self.snapshot = snapshot
+        self.book = book
+        self.changed = {}
+        self.deleted = set()
+        self.added = {}
+
+    def reset(self, snapshot):
+        self.snapshot = snapshot
+        self.changed.clear()
+        self.deleted.clear()
+        self.added.clear()
+
+    def _position(self, name):
+        return None if name in self.deleted else self.snapshot.find(name)
+
+    def _record(self, strings):
+        name, birthday, email, address, *phones = strings
+        return classes.Record.restore(name, birthday, email, address, phones)
+
+    def scan(self):
+        """
+        Yields the (name, record) pairs in the order of the book, decoding the snapshot from start to end.
+        """
+        for position in range(self.snapshot.count):
+            strings = self.snapshot.strings(position)
+            name = strings[0]
+            if name in self.deleted:
+                continue
+            record = self.changed.get(name) or self._record(strings)
+            record.book = self.book
+            yield name, record
+        for name, record in self.added.items():
+            record.book = self.book
+            yield name, record
+
+    def __getitem__(self, name):
+        record = self.added.get(name) or self.changed.get(name)
+        if record is None:
+            position = self._position(name)
+            if position is None:
+                raise KeyError(name)
+            record = self._record(self.snapshot.strings(position))
+        record.book = self.book
+        return record
+
+    def __setitem__(self, name, record):
+        if name in self.added or self._position(name) is None:
+            self.added[name] = record
+        else:
+            self.changed[name] = record
+
+    def __delitem__(self, name):
+        if name in self.added:
+            del self.added[name]
+            return
+        if self._position(name) is None:
+            raise KeyError(name)
+        self.changed.pop(name, None)
+        self.deleted.add(name)
+
+    def __contains__(self, name):
+        return name in self.added or self._position(name) is not None
+
+    def __iter__(self):
+        for position in range(self.snapshot.count):
+            name = self.snapshot.name(position)
+            if name not in self.deleted:
+                yield name
+        yield from self.added
+
+    def __len__(self):
+        return self.snapshot.count - len(self.deleted) + len(self.added)
+
+    def items(self):
+        return RecordItems(self)
+
+    def values(self):
+        return RecordValues(self)
+
+    def entries(self):
+        """
+        Yields the (name, source) entries of write_snapshot: the records that have not changed are copied
+        from the snapshot, the others are encoded.
+        """
+        for position in range(self.snapshot.count):
+            name = self.snapshot.name(position)
+            if name in self.deleted:
+                continue
+            record = self.changed.get(name)
+            yield name, position if record is None else encode_record(record)
+        for name, record in self.added.items():
+            yield name, encode_record(record)
+
+
+class SnapshotStorage:
+    """
+    Keeps the address book in a memory-mapped snapshot (<name>.snap) and a journal of the changes made since
+    (<name>.snap.journal). Opening the book only maps the file, and the records are decoded when they are used.
+    """
+
+    def __init__(self, name):
+        self.name = name
+        self.filename = f'{name}.snap'
+        self.journal = classes.Journal(f'{name}.snap.journal')
+        self.data = None
+        self.bulk = False
+
+    def load(self, owner):
+        # the first snapshot of a book is written from its pickle files
+        if not Path(self.filename).exists():
+            classes.PickleStorage(self.name).load(owner)
+            write_snapshot(self.filename, ((name, encode_record(record)) for name, record in owner.data.items()))
+        self.data = SnapshotRecords(Snapshot(self.filename), owner)
+        owner.data = self.data
+        for entry in self.journal.replay():
+            owner._apply(entry)
+
+    @persistence
+    def log(self, entry):
+        # a record decoded from the snapshot is a copy, so a record changed in place has to go into the overlay
+        if entry[0] == 'set':
+            self.data[entry[1]] = entry[2]
+        if self.bulk:
+            return
+        self.journal.append(entry)
+        if not classes.Journal.deferred and self.journal.entries >= classes.JOURNAL_COMPACT_THRESHOLD:
+            self.save()
+
+    @persistence
+    def save(self):
+        """
+        Writes a new snapshot with the changes folded in and maps it instead of the old one.
+        """
+        temporary = f'{self.filename}.tmp'
+        write_snapshot(temporary, self.data.entries(), self.data.snapshot)
+        # a mapped file cannot be replaced on every system, so the old snapshot is closed first
+        self.data.snapshot.close()
+        os.replace(temporary, self.filename)
+        self.data.reset(Snapshot(self.filename))
+        self.journal.clear()
+
+    @persistence
+    def commit(self):
+        if self.journal.entries >= classes.JOURNAL_COMPACT_THRESHOLD:
+            self.save()
+        else:
+            self.journal.commit()
+
+    @persistence
+    def close(self):
+        self.commit()
+        self.journal.close()
+        self.data.snapshot.close()
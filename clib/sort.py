@@ -1,65 +1,387 @@
+from collections import namedtuple
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+import argparse
+import errno
+import hashlib
+import json
+import os
 import shutil
 import pathlib
+import time
+
+from clib.archives import ARCHIVE_ERRORS, ArchiveExtractor, MAX_ARCHIVE_BYTES, MAX_ARCHIVE_MEMBERS, format_rate
 
 sorted_files = {}
 found_extension = set()
 unknown_extension = set()
+failed_files = []
+dedup_summary = {'duplicates': 0, 'bytes saved': 0}
+
+PARTIAL_HASH_SIZE = 64 * 1024
+HASH_CHUNK_SIZE = 1024 * 1024
+
+Move = namedtuple('Move', ['source', 'category', 'destination'])
 
 
-def sort_files(path, dest_dirs, work_extension, path_to_sort_folder):
+class Manifest:
     """
-    Sorts files by folders in a destination directory depending on the file extension.
+    Remembers the folders seen by the previous sort run (with their modification time and subfolders) and the
+    files left in them, so that the next run only lists the folders that have changed since.
     """
-    for path_element in pathlib.Path(path).iterdir():
-        if path_element.is_dir() and path_element.name not in dest_dirs:
-            sort_files(path_element, dest_dirs, work_extension, path_to_sort_folder)
-            if not any(path_element.iterdir()):
-                pathlib.Path(path_element).chmod(0o777)
-                pathlib.Path(path_element).rmdir()
+    filename = '.sort_manifest.json'
 
-        elif path_element.suffix.upper() in work_extension['video']:
+    def __init__(self, path_to_sort_folder):
+        self.root = str(path_to_sort_folder)
+        self.path = pathlib.Path(path_to_sort_folder) / self.filename
+        self.previous = {}
+        self.folders = {}
+        self.retried = set()
+        if self.path.exists():
             try:
-                shutil.move(path_element, rf'{path_to_sort_folder}\video')
-                found_extension.add(path_element.suffix)
-                sorted_files.setdefault('video', []).append(path_element.name)
-            except shutil.Error as error:
-                print(f"File move error: {error}")
+                self.previous = json.loads(self.path.read_text(encoding='utf-8'))['folders']
+            except (ValueError, KeyError):
+                self.previous = {}
 
-        elif path_element.suffix.upper() in work_extension['images']:
-            try:
-                shutil.move(path_element, rf'{path_to_sort_folder}\images')
-                found_extension.add(path_element.suffix)
-                sorted_files.setdefault('images', []).append(path_element.name)
-            except shutil.Error as error:
-                print(f"File move error: {error}")
+    def key(self, folder):
+        return os.path.relpath(folder, self.root)
 
-        elif path_element.suffix.upper() in work_extension['audio']:
-            try:
-                shutil.move(path_element, rf'{path_to_sort_folder}\audio')
-                found_extension.add(path_element.suffix)
-                sorted_files.setdefault('audio', []).append(path_element.name)
-            except shutil.Error as error:
-                print(f"File move error: {error}")
+    def unchanged_subfolders(self, folder):
+        """
+        Returns the names of the subfolders of a folder that has not changed since the previous run, or None if
+        the folder has to be listed again. Raises FileNotFoundError if the folder no longer exists.
+        """
+        key = self.key(folder)
+        mtime = os.stat(folder).st_mtime_ns
+        entry = self.previous.get(key)
+        if entry is None or entry['mtime'] != mtime:
+            return None
+        self.folders[key] = entry
+        return entry['subfolders']
 
-        elif path_element.suffix.upper() in work_extension['documents']:
-            try:
-                shutil.move(path_element, rf'{path_to_sort_folder}\documents')
-                found_extension.add(path_element.suffix)
-                sorted_files.setdefault('documents', []).append(path_element.name)
-            except shutil.Error as error:
-                print(f"File move error: {error}")
+    def visit(self, folder):
+        entry = {'mtime': None, 'subfolders': [], 'files': {}}
+        self.folders[self.key(folder)] = entry
+        return entry
+
+    def known_file(self, folder, entry):
+        """
+        Returns the [size, mtime] of a file left in the folder by the previous run if it has not changed since,
+        otherwise None.
+        """
+        known = self.previous.get(self.key(folder), {}).get('files', {}).get(entry.name)
+        if known is not None:
+            stat = entry.stat()
+            if known == [stat.st_size, stat.st_mtime_ns]:
+                return known
+        return None
+
+    def remember(self, path_element):
+        """
+        Records a file that stays in its folder after sorting.
+        """
+        stat = path_element.stat()
+        self.folders[self.key(path_element.parent)]['files'][path_element.name] = [stat.st_size, stat.st_mtime_ns]
+
+    def retry(self, path_element):
+        """
+        Leaves the folder of a file that could not be moved or unpacked out of the manifest,
+        so that the next run lists it again and retries the file.
+        """
+        key = self.key(path_element.parent)
+        self.folders.pop(key, None)
+        self.retried.add(key)
+
+    def save(self):
+        """
+        Stores the folders seen by this run with their modification time after sorting. The folders to retry
+        are not stored, but stay among the subfolders of their parents, so that the next run visits them.
+        The manifest file is created first, so that writing it does not change the time of the sort folder.
+        """
+        self.path.touch()
+        for key in list(self.folders):
+            if not os.path.isdir(os.path.join(self.root, key)):
+                del self.folders[key]
+        for key, entry in self.folders.items():
+            entry['subfolders'] = [name for name in entry['subfolders']
+                                   if os.path.normpath(os.path.join(key, name)) in self.folders
+                                   or os.path.normpath(os.path.join(key, name)) in self.retried]
+            entry['mtime'] = os.stat(os.path.join(self.root, key)).st_mtime_ns
+        self.path.write_text(json.dumps({'folders': self.folders}), encoding='utf-8')
 
-        elif path_element.suffix.upper() in work_extension['archives']:
+
+def scan_tree(path, dest_dirs, folders, manifest=None):
+    """
+    Walks the tree below path with os.scandir and yields the files found in it.
+    Folders named after the destination folders are skipped, and every visited folder is added to the folders list.
+    With a manifest, the folders that have not changed since the previous run are not listed again,
+    and neither are the files left unchanged in them.
+    """
+    stack = [path]
+    while stack:
+        current = stack.pop()
+        if manifest is not None:
             try:
-                shutil.unpack_archive(path_element, fr'{path_to_sort_folder}\archives\{path_element.stem}')
-                pathlib.Path(path_element).unlink()
-                found_extension.add(path_element.suffix)
-                sorted_files.setdefault('archives', []).append(path_element.name)
-            except shutil.Error as error:
-                print(f"File move / unpack error: {error}")
+                subfolders = manifest.unchanged_subfolders(current)
+            except FileNotFoundError:
+                continue
+            if subfolders is not None:
+                for name in subfolders:
+                    folders.append(os.path.join(current, name))
+                    stack.append(os.path.join(current, name))
+                continue
+            visited = manifest.visit(current)
 
-        else:
+        with os.scandir(current) as entries:
+            for entry in entries:
+                if entry.is_dir(follow_symlinks=False):
+                    if entry.name not in dest_dirs:
+                        folders.append(entry.path)
+                        stack.append(entry.path)
+                        if manifest is not None:
+                            visited['subfolders'].append(entry.name)
+                elif entry.name == Manifest.filename:
+                    continue
+                else:
+                    known = manifest.known_file(current, entry) if manifest is not None else None
+                    if known is None:
+                        yield pathlib.Path(entry.path)
+                    else:
+                        visited['files'][entry.name] = known
+
+
+def build_category_map(work_extension):
+    """
+    Turns the {category: extensions} dictionary into a {upper-case extension: category} one,
+    so that a file is classified by a single lookup.
+    """
+    return {extension: category for category, extensions in work_extension.items() for extension in extensions}
+
+
+def unique_destination(destination, planned):
+    """
+    Returns the destination path itself or, if a file with this name already exists or is planned,
+    the first free 'name (n).ext' path next to it.
+    """
+    candidate = destination
+    number = 1
+    while candidate in planned or candidate.exists():
+        candidate = destination.with_name(f'{destination.stem} ({number}){destination.suffix}')
+        number += 1
+    planned.add(candidate)
+    return candidate
+
+
+def plan_sort(path, dest_dirs, categories, path_to_sort_folder, folders, manifest=None):
+    """
+    Scans the tree once and returns the list of moves that sorting it takes, without touching any file.
+    Files with unknown extensions are added to unknown_extension and to the manifest, if there is one.
+    """
+    sort_folder = pathlib.Path(path_to_sort_folder)
+    planned = set()
+    plan = []
+    for path_element in scan_tree(path, dest_dirs, folders, manifest):
+        category = categories.get(path_element.suffix.upper())
+        if category is None:
             path_element.suffix != '' and unknown_extension.add(path_element.suffix)
+            manifest is not None and manifest.remember(path_element)
+        elif category == 'archives':
+            plan.append(Move(path_element, category, unique_destination(sort_folder / category / path_element.stem,
+                                                                        planned)))
+        else:
+            plan.append(Move(path_element, category, unique_destination(sort_folder / category / path_element.name,
+                                                                        planned)))
+    return plan
+
+
+def print_plan(plan):
+    """
+    Prints out the planned moves and the number of files in each category.
+    """
+    counts = {}
+    for move in plan:
+        print(f'{move.category}: {move.source} -> {move.destination}')
+        counts[move.category] = counts.get(move.category, 0) + 1
+    print(f'Planned moves: {len(plan)} {counts}')
+
+
+def file_hash(path_element, partial=False):
+    """
+    Returns the BLAKE2 digest of the first PARTIAL_HASH_SIZE bytes of a file, or of the whole file
+    read in chunks.
+    """
+    with open(path_element, 'rb') as file:
+        if partial:
+            return hashlib.blake2b(file.read(PARTIAL_HASH_SIZE)).digest()
+        digest = hashlib.blake2b()
+        while chunk := file.read(HASH_CHUNK_SIZE):
+            digest.update(chunk)
+        return digest.digest()
+
+
+def group_by_hash(moves, partial):
+    groups = {}
+    for move in moves:
+        try:
+            groups.setdefault(file_hash(move.source, partial), []).append(move)
+        except OSError:
+            continue
+    return [group for group in groups.values() if len(group) > 1]
+
+
+def find_duplicates(plan):
+    """
+    Returns {duplicate: original} for the planned files that are byte-identical to a file planned before them.
+    Only files of the same size are hashed: first their beginning, and then, if that matches too and the files
+    are longer, their whole content. Archives and empty files are left out.
+    """
+    by_size = {}
+    for move in plan:
+        if move.category != 'archives':
+            size = move.source.stat().st_size
+            if size:
+                by_size.setdefault(size, []).append(move)
+
+    duplicates = {}
+    for size, moves in by_size.items():
+        if len(moves) < 2:
+            continue
+        for group in group_by_hash(moves, partial=True):
+            for same in group_by_hash(group, partial=False) if size > PARTIAL_HASH_SIZE else [group]:
+                for duplicate in same[1:]:
+                    duplicates[duplicate] = same[0]
+    return duplicates
+
+
+def handle_duplicates(duplicates, mode):
+    """
+    Leaves the duplicates where they are ('skip') or replaces them with hard links to the sorted originals ('link'),
+    and adds the number of bytes saved to dedup_summary.
+    """
+    for duplicate, original in duplicates.items():
+        size = duplicate.source.stat().st_size
+        if mode == 'link':
+            try:
+                os.link(original.destination, duplicate.destination)
+                os.unlink(duplicate.source)
+            except OSError as error:
+                record_result(duplicate.category, duplicate.source, error)
+                continue
+            record_result(duplicate.category, duplicate.source, None)
+        dedup_summary['duplicates'] += 1
+        dedup_summary['bytes saved'] += size
+
+
+def move_file(path_element, destination):
+    """
+    Moves a file to the destination path. A plain rename is used when both are on the same file system.
+    """
+    try:
+        os.rename(path_element, destination)
+    except OSError as error:
+        if error.errno != errno.EXDEV:
+            raise
+        shutil.move(path_element, destination)
+
+
+def unpack_file(path_element, destination, max_bytes=MAX_ARCHIVE_BYTES, max_members=MAX_ARCHIVE_MEMBERS):
+    """
+    Unpacks an archive into the destination folder and removes the archive. If the archive breaks the limits,
+    whatever has been unpacked is removed and the archive is kept.
+    It runs in a separate process, so it only gets and returns plain values.
+    """
+    extractor = ArchiveExtractor(max_bytes, max_members)
+    try:
+        bytes_written, seconds = extractor.extract(path_element, destination)
+    except ARCHIVE_ERRORS:
+        shutil.rmtree(destination, ignore_errors=True)
+        raise
+    pathlib.Path(path_element).unlink()
+    return f'Unpacked {pathlib.Path(path_element).name}: {format_rate(bytes_written, seconds)}'
+
+
+def remove_empty_folders(folders):
+    """
+    Removes the folders that are left empty after sorting, the deepest first.
+    """
+    for folder in sorted(folders, key=lambda item: item.count(os.sep), reverse=True):
+        folder = pathlib.Path(folder)
+        if folder.is_dir() and not any(folder.iterdir()):
+            folder.chmod(0o777)
+            folder.rmdir()
+
+
+def record_result(category, path_element, error, report=None):
+    """
+    Adds the result of moving or unpacking a file to the summary and prints out the report of the task, if any.
+    """
+    if error is None:
+        found_extension.add(path_element.suffix)
+        sorted_files.setdefault(category, []).append(path_element.name)
+        report is not None and print(report)
+    elif category == 'archives':
+        failed_files.append(path_element)
+        print(f"File move / unpack error: {error}")
+    else:
+        failed_files.append(path_element)
+        print(f"File move error: {error}")
+
+
+def run_task(function, category, path_element, destination, *options):
+    try:
+        report = function(path_element, destination, *options)
+    except (shutil.Error, *ARCHIVE_ERRORS) as error:
+        return category, path_element, error, None
+    return category, path_element, None, report
+
+
+def execute_plan(plan, workers=1, batch_size=1000, archive_limits=(MAX_ARCHIVE_BYTES, MAX_ARCHIVE_MEMBERS)):
+    """
+    Performs the planned moves in batches of batch_size. Archives are unpacked within the given
+    (bytes, members) limits.
+    With more than one worker, files of a batch are moved by a pool of threads and archives are unpacked
+    by a pool of processes.
+    """
+    if workers <= 1:
+        for move in plan:
+            if move.category == 'archives':
+                record_result(*run_task(unpack_file, move.category, move.source, move.destination, *archive_limits))
+            else:
+                record_result(*run_task(move_file, move.category, move.source, move.destination))
+        return
+
+    with ThreadPoolExecutor(workers) as movers, ProcessPoolExecutor(workers) as unpackers:
+        for start in range(0, len(plan), batch_size):
+            futures = []
+            for move in plan[start:start + batch_size]:
+                if move.category == 'archives':
+                    futures.append(unpackers.submit(run_task, unpack_file, move.category, move.source,
+                                                    move.destination, *archive_limits))
+                else:
+                    futures.append(movers.submit(run_task, move_file, move.category, move.source,
+                                                 move.destination))
+            for future in futures:
+                record_result(*future.result())
+
+
+def sort_files(path, dest_dirs, work_extension, path_to_sort_folder, workers=1, batch_size=1000,
+               incremental=False, archive_limits=(MAX_ARCHIVE_BYTES, MAX_ARCHIVE_MEMBERS), dedup=None):
+    """
+    Sorts files by folders in a destination directory depending on the file extension.
+    In incremental mode, the manifest kept in the sort folder lets the run skip what has not changed since
+    the previous one. With dedup set to 'skip' or 'link', byte-identical files are moved only once.
+    """
+    folders = []
+    failed_files.clear()
+    manifest = Manifest(path_to_sort_folder) if incremental else None
+    plan = plan_sort(path, dest_dirs, build_category_map(work_extension), path_to_sort_folder, folders, manifest)
+    duplicates = find_duplicates(plan) if dedup else {}
+    execute_plan([move for move in plan if move not in duplicates], workers, batch_size, archive_limits)
+    handle_duplicates(duplicates, dedup)
+    remove_empty_folders(folders)
+    if manifest is not None:
+        for path_element in failed_files:
+            manifest.retry(path_element)
+        manifest.save()
 
 
 def output_sort_information():
@@ -71,14 +393,47 @@ def output_sort_information():
         print(f'The script sorted the files with extensions: {found_extension}')
     if unknown_extension:
         print(f'The script did not sort files with unknown extensions: {unknown_extension}')
+    if failed_files:
+        print(f'The script could not move or unpack {len(failed_files)} files, they are left in place '
+              f'and will be retried on the next run: {[path_element.name for path_element in failed_files]}')
+    if dedup_summary['duplicates']:
+        print(f"The script found {dedup_summary['duplicates']} duplicate files, "
+              f"{dedup_summary['bytes saved']} bytes saved")
+
+
+def parse_arguments(args):
+    """
+    Parses the arguments of the sort command:
+    sort [--workers N] [--batch-size N] [--dry-run] [--full] [--max-archive-bytes N] [--max-archive-members N]
+         [--dedup skip|link] [path to a folder]
+    """
+    parser = argparse.ArgumentParser(prog='sort', exit_on_error=False, add_help=False)
+    parser.add_argument('--workers', type=int, default=1)
+    parser.add_argument('--batch-size', type=int, default=1000)
+    parser.add_argument('--dry-run', action='store_true')
+    parser.add_argument('--full', action='store_true')
+    parser.add_argument('--max-archive-bytes', type=int, default=MAX_ARCHIVE_BYTES)
+    parser.add_argument('--max-archive-members', type=int, default=MAX_ARCHIVE_MEMBERS)
+    parser.add_argument('--dedup', choices=('skip', 'link'))
+    parser.add_argument('path', nargs='*')
+    return parser.parse_args(args)
 
 
-def main():
+def main(*args):
     """
     The main function that performs file sorting and prints out the summary.
     The files are sorted by folders in a destination directory depending on extensions.
     """
-    path_to_sort_folder = input("Enter the path to the folder you want to sort: ")
+    try:
+        arguments = parse_arguments(args)
+    except (argparse.ArgumentError, SystemExit):
+        return ('Usage: sort [--workers N] [--batch-size N] [--dry-run] [--full] [--max-archive-bytes N] '
+                '[--max-archive-members N] [--dedup skip|link] [path to a folder]')
+
+    if arguments.path:
+        path_to_sort_folder = ' '.join(arguments.path)
+    else:
+        path_to_sort_folder = input("Enter the path to the folder you want to sort: ")
 
     dest_dirs = ['images', 'video', 'audio', 'documents', 'archives']
     work_extension = {'images': ('.JPEG', '.PNG', '.JPG', '.SVG'),
@@ -87,13 +442,28 @@ def main():
                       'documents': ('.DOC', '.DOCX', '.TXT', '.PDF', '.XLSX', '.PPTX'),
                       'archives': ('.ZIP', '.GZ', '.TAR')}
 
+    if arguments.dry_run:
+        started = time.perf_counter()
+        manifest = None if arguments.full else Manifest(path_to_sort_folder)
+        plan = plan_sort(path_to_sort_folder, dest_dirs, build_category_map(work_extension), path_to_sort_folder, [],
+                         manifest)
+        print_plan(plan)
+        if arguments.dedup:
+            duplicates = find_duplicates(plan)
+            print(f'Duplicates: {len(duplicates)}, '
+                  f'bytes to be saved: {sum(move.source.stat().st_size for move in duplicates)}')
+        print(f'Planning took {time.perf_counter() - started:.3f} s. No files have been moved.')
+        return ""
+
     # check if there are folders 'images', 'video', 'audio', 'documents', 'archives'
     # in the folder to be sorted. If these folders are missing, they are created
     for folder in dest_dirs:
-        if not pathlib.Path(fr'{path_to_sort_folder}\{folder}').exists():
-            pathlib.Path(fr'{path_to_sort_folder}\{folder}').mkdir()
+        if not (pathlib.Path(path_to_sort_folder) / folder).exists():
+            (pathlib.Path(path_to_sort_folder) / folder).mkdir()
 
-    sort_files(path_to_sort_folder, dest_dirs, work_extension, path_to_sort_folder)
+    sort_files(path_to_sort_folder, dest_dirs, work_extension, path_to_sort_folder, arguments.workers,
+               arguments.batch_size, not arguments.full,
+               (arguments.max_archive_bytes, arguments.max_archive_members), arguments.dedup)
     output_sort_information()
 
     return ""
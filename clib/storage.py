@@ -0,0 +1,347 @@
+import sqlite3
+from collections.abc import ItemsView, MutableMapping, ValuesView
+
+from clib import classes
+from clib.instrumentation import persistence
+
+SCHEMA_VERSION = 4
+FTS_TRIGRAM = sqlite3.sqlite_version_info >= (3, 34)
+
+
+class SqliteStorage:
+    """
+    Keeps a store in an SQLite database (<name>.db) instead of pickles. The records are read from the database
+    when they are used, so the store is never loaded as a whole, and the searches run on the indexed tables.
+    Every change is committed at once, except while bulk or Journal.deferred is set; then commit() or save() does it.
+    A new database is filled from the pickled snapshot and journal of the store, if there are any.
+    """
+
+    def __init__(self, name):
+        self.name = name
+        self.connection = sqlite3.connect(f'{name}.db')
+        self.data = None
+        self.bulk = False
+
+    def load(self, owner):
+        mapping = MAPPINGS[self.name]
+        self.data = mapping(self.connection, owner)
+        version = self.connection.execute('PRAGMA user_version').fetchone()[0]
+        if version < SCHEMA_VERSION:
+            mapping.create(self.connection, version)
+            if version == 0:
+                self._migrate(owner)
+            self.connection.execute(f'PRAGMA user_version = {SCHEMA_VERSION}')
+            self.connection.commit()
+        owner.data = self.data
+
+    def _migrate(self, owner):
+        classes.PickleStorage(self.name).load(owner)
+        # notes saved before they had ids are kept in a list and get their positions as ids
+        items = owner.data.items() if isinstance(owner.data, dict) else enumerate(owner.data)
+        for key, value in items:
+            self.data[key] = value
+
+    @persistence
+    def log(self, entry):
+        # the mapping has already written added and deleted items ('add', 'del' and 'delete' entries),
+        # only the changes made in place are left
+        if entry[0] == 'set':
+            self.data[entry[1]] = entry[2]
+        elif entry[0] == 'edit':
+            self.data.set_text(entry[1], entry[2])
+        if not self.bulk and not classes.Journal.deferred:
+            self.connection.commit()
+
+    @persistence
+    def save(self):
+        self.connection.commit()
+
+    @persistence
+    def commit(self):
+        self.connection.commit()
+
+    @persistence
+    def close(self):
+        self.connection.commit()
+        self.connection.close()
+
+
+class SqliteRecords(MutableMapping):
+    """
+    Maps names to the records kept in the contacts and phones tables, in the order the names were added.
+    Every access reads the record from the database; the changes are written by assigning the record again.
+    The names and phones are also indexed in a full-text table with the trigram tokenizer for the substring search.
+    """
+    indexed = True
+
+    def __init__(self, connection, book):
+        self.connection = connection
+        self.book = book
+
+    @staticmethod
+    def create(connection, version):
+        """
+        Creates the tables missing from a database of the given schema version.
+        """
+        if version < 1:
+            connection.executescript('''
+                CREATE TABLE contacts (seq INTEGER PRIMARY KEY AUTOINCREMENT, name TEXT NOT NULL UNIQUE,
+                                       folded TEXT NOT NULL, birthday TEXT, ordinal INTEGER, email TEXT, address TEXT);
+                CREATE TABLE phones (name TEXT NOT NULL, phone TEXT NOT NULL);
+                CREATE INDEX contacts_ordinal ON contacts (ordinal);
+                CREATE INDEX phones_name ON phones (name);
+            ''')
+        if version < 3:
+            connection.execute('ALTER TABLE phones ADD COLUMN number INTEGER')
+            rows = connection.execute('SELECT rowid, phone FROM phones').fetchall()
+            connection.executemany('UPDATE phones SET number = ? WHERE rowid = ?',
+                                   ((classes.phone_number(phone), rowid) for rowid, phone in rows))
+            connection.execute('CREATE INDEX phones_number ON phones (number)')
+        if version < 4:
+            connection.execute('DROP INDEX IF EXISTS phones_phone')
+            if FTS_TRIGRAM:
+                connection.execute("CREATE VIRTUAL TABLE contact_text USING fts5 (name, phones, tokenize = 'trigram')")
+                connection.execute("INSERT INTO contact_text (rowid, name, phones) SELECT seq, name, "
+                                   "coalesce((SELECT group_concat(phone, char(10)) FROM phones "
+                                   "WHERE phones.name = contacts.name), '') FROM contacts")
+
+    def _record(self, name, birthday, email, address):
+        phones = self.connection.execute('SELECT phone FROM phones WHERE name = ? ORDER BY rowid', (name,))
+        record = classes.Record.restore(name, birthday, email, address, (phone for phone, in phones))
+        record.book = self.book
+        return record
+
+    def _records(self, condition='', parameters=()):
+        """
+        Yields (seq, record) pairs of the contacts that meet the SQL condition.
+        """
+        rows = self.connection.execute(f'SELECT seq, name, birthday, email, address FROM contacts {condition}',
+                                       parameters)
+        for seq, *row in rows:
+            yield seq, self._record(*row)
+
+    def __getitem__(self, name):
+        row = self.connection.execute('SELECT name, birthday, email, address FROM contacts WHERE name = ?',
+                                      (name,)).fetchone()
+        if row is None:
+            raise KeyError(name)
+        return self._record(*row)
+
+    @persistence
+    def __setitem__(self, name, record):
+        birthday = record.birthday
+        self.connection.execute('INSERT INTO contacts (name, folded, birthday, ordinal, email, address) '
+                                'VALUES (?, ?, ?, ?, ?, ?) ON CONFLICT (name) DO UPDATE SET '
+                                'birthday = excluded.birthday, ordinal = excluded.ordinal, '
+                                'email = excluded.email, address = excluded.address',
+                                (name, name.lower(), birthday and birthday.value, birthday and birthday.ordinal,
+                                 record.email and record.email.value, record.address and record.address.value))
+        self.connection.execute('DELETE FROM phones WHERE name = ?', (name,))
+        self.connection.executemany('INSERT INTO phones (name, phone, number) VALUES (?, ?, ?)',
+                                    ((name, phone.value, phone.number) for phone in record.phones))
+        if FTS_TRIGRAM:
+            seq = self.connection.execute('SELECT seq FROM contacts WHERE name = ?', (name,)).fetchone()[0]
+            self.connection.execute('DELETE FROM contact_text WHERE rowid = ?', (seq,))
+            self.connection.execute('INSERT INTO contact_text (rowid, name, phones) VALUES (?, ?, ?)',
+                                    (seq, name, '\n'.join(phone.value for phone in record.phones)))
+
+    @persistence
+    def __delitem__(self, name):
+        row = self.connection.execute('SELECT seq FROM contacts WHERE name = ?', (name,)).fetchone()
+        if row is None:
+            raise KeyError(name)
+        self.connection.execute('DELETE FROM contacts WHERE seq = ?', row)
+        self.connection.execute('DELETE FROM phones WHERE name = ?', (name,))
+        if FTS_TRIGRAM:
+            self.connection.execute('DELETE FROM contact_text WHERE rowid = ?', row)
+
+    def __contains__(self, name):
+        return self.connection.execute('SELECT 1 FROM contacts WHERE name = ?', (name,)).fetchone() is not None
+
+    def __iter__(self):
+        for name, in self.connection.execute('SELECT name FROM contacts ORDER BY seq'):
+            yield name
+
+    def __len__(self):
+        return self.connection.execute('SELECT count(*) FROM contacts').fetchone()[0]
+
+    def items(self):
+        return RecordItems(self)
+
+    def values(self):
+        return RecordValues(self)
+
+    def scan(self):
+        for seq, record in self._records('ORDER BY seq'):
+            yield record.name.value, record
+
+    def search(self, pattern):
+        """
+        Yields (name, record) pairs of the contacts whose name (case-insensitive) or one of the phones
+        contains the pattern, in the order of the book.
+        """
+        condition = ('(instr(folded, ?) OR EXISTS (SELECT 1 FROM phones WHERE phones.name = contacts.name '
+                     'AND instr(phone, ?)))')
+        parameters = [pattern.lower(), pattern]
+        # the trigram index needs at least three characters and ignores case, instr() checks the exact text
+        if FTS_TRIGRAM and len(pattern) >= 3:
+            condition = f'seq IN (SELECT rowid FROM contact_text WHERE contact_text MATCH ?) AND {condition}'
+            parameters.insert(0, '"' + pattern.replace('"', '""') + '"')
+        for seq, record in self._records(f'WHERE {condition} ORDER BY seq', parameters):
+            yield record.name.value, record
+
+    def owners(self, number):
+        rows = self.connection.execute('SELECT name FROM contacts WHERE name IN '
+                                       '(SELECT name FROM phones WHERE number = ?) ORDER BY seq', (number,))
+        return [name for name, in rows]
+
+    def birthday_names(self, first, last):
+        rows = self.connection.execute('SELECT name FROM contacts WHERE ordinal BETWEEN ? AND ?', (first, last))
+        return [name for name, in rows]
+
+    def page(self, page_num, n_records):
+        for seq, record in self._records('ORDER BY seq LIMIT ? OFFSET ?', (n_records, (page_num - 1) * n_records)):
+            yield record.name.value, record
+
+    def page_after(self, cursor, n_records):
+        page = {}
+        for cursor, record in self._records('WHERE seq > ? ORDER BY seq LIMIT ?', (cursor or 0, n_records)):
+            page[record.name.value] = record
+        return page, cursor
+
+
+class RecordItems(ItemsView):
+    """
+    Reads the contacts in a single pass instead of looking every name up again.
+    Works for any mapping of records with a scan() method that yields the (name, record) pairs in order.
+    """
+
+    def __iter__(self):
+        yield from self._mapping.scan()
+
+
+class RecordValues(ValuesView):
+
+    def __iter__(self):
+        for name, record in self._mapping.scan():
+            yield record
+
+
+class SqliteNotes(MutableMapping):
+    """
+    Maps ids to the notes kept in the notes and note_tags tables. The text of the notes is also indexed
+    in a full-text table with the trigram tokenizer, so that a substring search does not read every note.
+    """
+    indexed = True
+
+    def __init__(self, connection, note_book):
+        self.connection = connection
+
+    @staticmethod
+    def create(connection, version):
+        """
+        Creates the tables missing from a database of the given schema version.
+        """
+        if version < 1:
+            connection.executescript('''
+                CREATE TABLE notes (id INTEGER PRIMARY KEY, text TEXT NOT NULL, title TEXT);
+                CREATE TABLE note_tags (id INTEGER NOT NULL, tag TEXT NOT NULL);
+                CREATE INDEX note_tags_id ON note_tags (id);
+                CREATE INDEX note_tags_tag ON note_tags (tag);
+            ''')
+            if FTS_TRIGRAM:
+                connection.execute("CREATE VIRTUAL TABLE note_text USING fts5 (text, tokenize = 'trigram')")
+        if version < 2:
+            connection.execute('CREATE VIRTUAL TABLE note_words USING fts5 (title, text)')
+            connection.execute("INSERT INTO note_words (rowid, title, text) SELECT id, coalesce(title, ''), text "
+                               'FROM notes')
+
+    def __getitem__(self, note_id):
+        row = self.connection.execute('SELECT text, title FROM notes WHERE id = ?', (note_id,)).fetchone()
+        if row is None:
+            raise KeyError(note_id)
+        tags = self.connection.execute('SELECT tag FROM note_tags WHERE id = ? ORDER BY rowid', (note_id,))
+        note = classes.Note(row[0], [tag for tag, in tags], row[1])
+        note.id = note_id
+        return note
+
+    @persistence
+    def __setitem__(self, note_id, note):
+        self.connection.execute('INSERT OR REPLACE INTO notes (id, text, title) VALUES (?, ?, ?)',
+                                (note_id, note.text, note.title))
+        self.connection.execute('DELETE FROM note_tags WHERE id = ?', (note_id,))
+        self.connection.executemany('INSERT INTO note_tags (id, tag) VALUES (?, ?)',
+                                    ((note_id, tag) for tag in note.tags or ()))
+        self.connection.execute('DELETE FROM note_words WHERE rowid = ?', (note_id,))
+        self.connection.execute('INSERT INTO note_words (rowid, title, text) VALUES (?, ?, ?)',
+                                (note_id, note.title or '', note.text))
+        self._index_text(note_id, note.text)
+
+    @persistence
+    def __delitem__(self, note_id):
+        if not self.connection.execute('DELETE FROM notes WHERE id = ?', (note_id,)).rowcount:
+            raise KeyError(note_id)
+        self.connection.execute('DELETE FROM note_tags WHERE id = ?', (note_id,))
+        self.connection.execute('DELETE FROM note_words WHERE rowid = ?', (note_id,))
+        if FTS_TRIGRAM:
+            self.connection.execute('DELETE FROM note_text WHERE rowid = ?', (note_id,))
+
+    def __contains__(self, note_id):
+        return self.connection.execute('SELECT 1 FROM notes WHERE id = ?', (note_id,)).fetchone() is not None
+
+    def __iter__(self):
+        for note_id, in self.connection.execute('SELECT id FROM notes ORDER BY id'):
+            yield note_id
+
+    def __len__(self):
+        return self.connection.execute('SELECT count(*) FROM notes').fetchone()[0]
+
+    def _index_text(self, note_id, text):
+        if FTS_TRIGRAM:
+            self.connection.execute('DELETE FROM note_text WHERE rowid = ?', (note_id,))
+            self.connection.execute('INSERT INTO note_text (rowid, text) VALUES (?, ?)', (note_id, text))
+
+    @persistence
+    def set_text(self, note_id, text):
+        self.connection.execute('UPDATE notes SET text = ? WHERE id = ?', (text, note_id))
+        self.connection.execute('UPDATE note_words SET text = ? WHERE rowid = ?', (text, note_id))
+        self._index_text(note_id, text)
+
+    def search(self, text=None, tags=()):
+        """
+        Returns ids of the notes that contain the text and have at least one of the tags, in the order
+        the notes were added. Either condition is skipped when it is not given.
+        """
+        conditions, parameters = [], []
+        if tags:
+            conditions.append(f'id IN (SELECT id FROM note_tags WHERE tag IN ({", ".join("?" * len(tags))}))')
+            parameters.extend(tags)
+        if text:
+            # the trigram index needs at least three characters and ignores case, instr() checks the exact text
+            if FTS_TRIGRAM and len(text) >= 3:
+                conditions.append('id IN (SELECT rowid FROM note_text WHERE note_text MATCH ?)')
+                parameters.append('"' + text.replace('"', '""') + '"')
+            conditions.append('instr(text, ?)')
+            parameters.append(text)
+        condition = f'WHERE {" AND ".join(conditions)}' if conditions else ''
+        return [note_id for note_id, in self.connection.execute(f'SELECT id FROM notes {condition} ORDER BY id',
+                                                                 parameters)]
+
+    def rank(self, text, tags=(), limit=10):
+        """
+        Returns ids of up to limit notes whose title or text contain words of the text, the best matches by the bm25()
+        function of FTS5 first. When tags are given, only the notes that have at least one of them are ranked.
+        """
+        words = classes.RankedIndex.words(text)
+        if not words:
+            return []
+        condition, parameters = 'note_words MATCH ?', [' OR '.join(f'"{word}"' for word in words)]
+        if tags:
+            condition += f' AND rowid IN (SELECT id FROM note_tags WHERE tag IN ({", ".join("?" * len(tags))}))'
+            parameters.extend(tags)
+        rows = self.connection.execute(f'SELECT rowid FROM note_words WHERE {condition} '
+                                       'ORDER BY bm25(note_words), rowid LIMIT ?', (*parameters, limit))
+        return [note_id for note_id, in rows]
+
+
+MAPPINGS = {'address_book': SqliteRecords, 'note_book': SqliteNotes}